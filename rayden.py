@@ -3,28 +3,84 @@
 __author__ = 'Douglas Uba'
 
 import argparse
+import sys
+import numpy as np
+from rayden import floats, sampler
 from rayden.color import RGB
 from rayden.render import RayTracer 
 from rayden.scene import Reader
 
+def compileScene(argv):
+    parser = argparse.ArgumentParser(description='Rayden - Compile a scene (built geometry and BVHs) for fast loading', prog='rayden compile')
+    parser.add_argument('scene', help='Scene description file', type=str)
+    parser.add_argument('--output', '-o', help='Compiled scene file. Default: scene file with .rdz extension', type=str, dest='output', default=None, required=False)
+    parser.add_argument('--precision', help='Floating-point precision of the renders that will use it', type=str, dest='precision', default='float64', choices=['float64', 'float32'], required=False)
+    args = parser.parse_args(argv)
+    floats.setPrecision(args.precision)
+    print(Reader.compile(args.scene, args.output))
+
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['compile']:
+        compileScene(sys.argv[2:])
+        sys.exit()
+
     # Create command-line parser
     parser = argparse.ArgumentParser(description='Rayden - Simple Python Ray Tracing', prog='rayden')
-    parser.add_argument('--scene', '-s', help='Scene description file', type=str, dest='scene', required=True)
+    parser.add_argument('--scene', '-s', help='Scene description file (JSON) or compiled scene (.rdz)', type=str, dest='scene', required=True)
     parser.add_argument('--output', '-o', help='Output file', type=str, dest='output', required=True)
     parser.add_argument('--samplesPerPixel', '-sp', help='Samples per pixel', type=int, dest='spixel', default=1, required=False)
     parser.add_argument('--samplesPerShadow', '-ss', help='Samples per shadow', type=int, dest='sshadow', default=1, required=False)
     parser.add_argument('--depthComplexity', '-dp', help='Depth complexity (depth of field)', type=int, dest='depthComplexity', default=1, required=False)
     parser.add_argument('--dispersion', '-dis', help='Dispersion (depth of field)', type=int, dest='dispersion', default=5, required=False)
+    parser.add_argument('--aperture', help='Thin lens aperture (depth of field per ray, instead of depthComplexity passes)', type=float, dest='aperture', default=None, required=False)
+    parser.add_argument('--focalDistance', help='Distance of the plane in focus (thin lens). Default: distance to lookAt', type=float, dest='focalDistance', default=None, required=False)
     parser.add_argument('--phong', help='Use classical Phong for specular component. Blinn-Phong, otherwise.', action='store_true', dest='phong')
+    parser.add_argument('--maxDepth', '-md', help='Maximum number of bounces (reflection and refraction)', type=int, dest='maxDepth', default=8, required=False)
+    parser.add_argument('--russianRoulette', help='Terminate secondary rays randomly, based on their throughput', action='store_true', dest='russianRoulette')
+    parser.add_argument('--tileSize', '-ts', help='Tile size (pixels) handled by each worker task', type=int, dest='tileSize', default=32, required=False)
+    parser.add_argument('--processes', '-np', help='Number of worker processes. Default: number of CPUs', type=int, dest='processes', default=None, required=False)
+    parser.add_argument('--backend', help='Intersection kernels: numpy or numba (compiled)', type=str, dest='backend', default='numpy', choices=['numpy', 'numba'], required=False)
+    parser.add_argument('--stats', help='Print acceleration structure statistics', action='store_true', dest='stats')
+    parser.add_argument('--adaptive', help='Adaptive sampling. samplesPerPixel is the maximum number of samples, in this case.', action='store_true', dest='adaptive')
+    parser.add_argument('--adaptiveThreshold', '-at', help='Confidence interval (luminance) that stops adaptive sampling', type=float, dest='adaptiveThreshold', default=0.01, required=False)
+    parser.add_argument('--minSamplesPerPixel', '-msp', help='Minimum samples per pixel (adaptive sampling)', type=int, dest='minSamplesPerPixel', default=4, required=False)
+    parser.add_argument('--sampler', help='Pixel, lens and light samples: independent random or low-discrepancy sequences', type=str, dest='sampler', default=sampler.RANDOM, choices=[sampler.RANDOM, sampler.STRATIFIED, sampler.HALTON, sampler.SOBOL], required=False)
+    parser.add_argument('--seed', help='Seed of the random samples (reproducible images). Default: a new one per run', type=int, dest='seed', default=None, required=False)
+    parser.add_argument('--cache', help='Directory of compiled scenes, reused while the scene and rayden are unchanged (trusted files only). Default: no cache', type=str, dest='cache', default=None, required=False)
+    parser.add_argument('--precision', help='Floating-point precision: float64 or float32 (faster, less memory)', type=str, dest='precision', default='float64', choices=['float64', 'float32'], required=False)
 
      # Parse input
     args = parser.parse_args()
 
+    # The scene is built in the selected precision
+    floats.setPrecision(args.precision)
+
+    # Thin lens, overriding the scene camera
+    scene = Reader.read(args.scene, args.cache)
+    camera = scene.getCamera()
+    if args.aperture is not None or args.focalDistance is not None:
+        camera.setLens(camera.aperture if args.aperture is None else args.aperture,
+                       camera.focalDistance if args.focalDistance is None else args.focalDistance)
+
+    # Random samples and sampler scrambling from the same seed (fresh entropy, if not given)
+    seed = np.random.SeedSequence(args.seed)
+
     # Render
-    rt = RayTracer(Reader.read(args.scene), samplesPerPixel=args.spixel,
+    rt = RayTracer(scene, samplesPerPixel=args.spixel,
                    samplesPerShadow=args.sshadow, depthComplexity=args.depthComplexity,
-                   dispersion=args.dispersion, Phong=args.phong)
+                   dispersion=args.dispersion, Phong=args.phong,
+                   maxDepth=args.maxDepth, russianRoulette=args.russianRoulette, backend=args.backend,
+                   tileSize=args.tileSize, processes=args.processes,
+                   adaptive=args.adaptive, adaptiveThreshold=args.adaptiveThreshold,
+                   minSamplesPerPixel=args.minSamplesPerPixel, precision=args.precision,
+                   sampler=sampler.create(args.sampler, args.spixel, int(seed.generate_state(1, np.uint64)[0])),
+                   seed=seed.entropy)
 
     image = rt.render()
     image.save(args.output)
+
+    if args.stats:
+        for key, value in rt.scene.getAccelerator().getStats().items():
+            print('{}: {}'.format(key, value))
+        for key, value in rt.counters.items():
+            print('{}: {}'.format(key, value))
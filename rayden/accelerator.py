@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Douglas Uba'
+
+from abc import ABC, abstractmethod
+import numpy as np
+from rayden import floats
+from rayden.bvh import BVH
+
+class NearestHit():
+    # Running nearest distance, primitive index and member per ray, updated in place
+    # as each primitive is tested (memory does not depend on the number of primitives)
+    def __init__(self, size):
+        self.nearest = floats.distances(size)
+        self.ids = np.full(size, -1)
+        self.members = np.full(size, -1)
+        self.closer = np.empty(size, dtype=bool)
+
+    def update(self, t, id, member=None):
+        closer = np.less(t, self.nearest, out=self.closer)
+        np.copyto(self.nearest, t, where=closer)
+        np.copyto(self.ids, id, where=closer)
+        # Single primitives have no members (-1)
+        np.copyto(self.members, -1 if member is None else member, where=closer)
+
+    def result(self):
+        return self.nearest, self.ids, self.members
+
+class Accelerator(ABC):
+    def __init__(self, primitives):
+        self.primitives = primitives
+        self.stats = {}
+        self.resetCounters()
+
+    def resetCounters(self):
+        # Traversal statistics
+        self.counters = {'rays': 0, 'nodeTests': 0, 'primitiveTests': 0}
+
+    def getStats(self):
+        return self.stats
+
+    @abstractmethod
+    def intersect(self, rays):
+        # Returns the nearest distance and the primitive index (-1 for no hit) per ray
+        pass
+
+    @abstractmethod
+    def occluded(self, rays, maxDistance):
+        # Returns True for rays that hit something closer than maxDistance
+        pass
+
+class PrimitiveList(Accelerator):
+    def intersect(self, rays):
+        self.counters['rays'] += rays.size()
+        self.counters['primitiveTests'] += rays.size() * len(self.primitives)
+        hits = NearestHit(rays.size())
+        for i, p in enumerate(self.primitives):
+            t, member = p.interceptMember(rays)
+            hits.update(t, i, member)
+        return hits.result()
+
+    def occluded(self, rays, maxDistance):
+        self.counters['rays'] += rays.size()
+        occluded = np.zeros(rays.size(), dtype=bool)
+        maxDistance = np.broadcast_to(maxDistance, occluded.shape)
+        for p in self.primitives:
+            # Skip rays that are already occluded
+            active = np.flatnonzero(~occluded)
+            if active.shape[0] == 0:
+                break
+            self.counters['primitiveTests'] += active.shape[0]
+            if active.shape[0] == occluded.shape[0]:
+                occluded = p.occluded(rays, maxDistance)
+            else:
+                occluded[active] = p.occluded(rays.take(active), maxDistance[active])
+        return occluded
+
+class BVHAccelerator(Accelerator):
+    def __init__(self, primitives, leafSize=4):
+        super().__init__(primitives)
+        # Unbounded primitives (e.g. planes) are kept in a separate list
+        bounds = [p.getBounds() for p in primitives]
+        self.bounded = np.array([i for i, b in enumerate(bounds) if b is not None], dtype=np.int64)
+        self.unbounded = [i for i, b in enumerate(bounds) if b is None]
+        lower = [bounds[i][0].components() for i in self.bounded]
+        upper = [bounds[i][1].components() for i in self.bounded]
+        self.bvh = BVH(np.reshape(lower, (-1, 3)), np.reshape(upper, (-1, 3)), leafSize)
+        self.stats = dict(self.bvh.stats, unbounded=len(self.unbounded))
+
+    def intersect(self, rays):
+        self.counters['rays'] += rays.size()
+        hits = NearestHit(rays.size())
+        for i in self.unbounded:
+            t, member = self.primitives[i].interceptMember(rays)
+            self.counters['primitiveTests'] += rays.size()
+            hits.update(t, i, member)
+        nearest, ids, members = hits.result()
+        origin, direction = rays.arrays()
+        leaf = lambda items, subset: self.__intersectLeaf(rays.take(subset), items)
+        nearest, items, members = self.bvh.intersect(origin, direction, leaf, nearest, members=members, counters=self.counters)
+        # Items of the hierarchy to primitive indices
+        hit = items != -1
+        ids[hit] = self.bounded[items[hit]]
+        return nearest, ids, members
+
+    def __intersectLeaf(self, rays, items):
+        hits = NearestHit(rays.size())
+        for item in items:
+            t, member = self.primitives[self.bounded[item]].interceptMember(rays)
+            hits.update(t, item, member)
+        return hits.result()
+
+    def occluded(self, rays, maxDistance):
+        self.counters['rays'] += rays.size()
+        occluded = np.zeros(rays.size(), dtype=bool)
+        maxDistance = np.broadcast_to(maxDistance, occluded.shape)
+        for i in self.unbounded:
+            active = np.flatnonzero(~occluded)
+            if active.shape[0] == 0:
+                return occluded
+            self.counters['primitiveTests'] += active.shape[0]
+            occluded[active] = self.primitives[i].occluded(rays.take(active), maxDistance[active])
+        origin, direction = rays.arrays()
+        leaf = lambda items, subset, distance: self.__occludedLeaf(rays.take(subset), distance, items)
+        return self.bvh.occluded(origin, direction, maxDistance, leaf, occluded, counters=self.counters)
+
+    def __occludedLeaf(self, rays, maxDistance, items):
+        occluded = np.zeros(rays.size(), dtype=bool)
+        for item in items:
+            active = np.flatnonzero(~occluded)
+            if active.shape[0] == 0:
+                break
+            occluded[active] = self.primitives[self.bounded[item]].occluded(rays.take(active), maxDistance[active])
+        return occluded
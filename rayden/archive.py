@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Douglas Uba'
+
+# Object graphs (e.g. built scenes) stored as an uncompressed .npz file: a JSON header, a pickle stream
+# and its large arrays, stored out-of-band as .npy members. Members are aligned, so arrays are
+# memory-mapped in place when the archive is loaded (no copies, pages are read on demand).
+# Archives are pickle streams: only load the ones you trust.
+
+import json
+import os
+import pickle
+import struct
+import zipfile
+import numpy as np
+
+# Arrays smaller than this are kept in the pickle stream
+MIN_BUFFER_SIZE = 1 << 16
+
+# Alignment of the array data inside of the file
+ALIGNMENT = 64
+
+# Zip local file header: fixed size and sizes of the zip64 and padding extra fields
+LOCAL_HEADER_SIZE = 30
+ZIP64_EXTRA_SIZE = 20
+PADDING_EXTRA_ID = 0x6472
+
+def save(file, obj, header=None):
+    buffers = []
+    def outOfBand(buffer):
+        # A true value keeps the buffer in the pickle stream
+        if buffer.raw().nbytes < MIN_BUFFER_SIZE:
+            return True
+        buffers.append(buffer)
+        return False
+    stream = pickle.dumps(obj, protocol=5, buffer_callback=outOfBand)
+    # Written aside and renamed (concurrent readers never see partial files)
+    temporary = '{}.{}.tmp'.format(file, os.getpid())
+    with zipfile.ZipFile(temporary, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        _write(archive, 'header', np.frombuffer(json.dumps(header or {}).encode(), dtype=np.uint8))
+        _write(archive, 'objects', np.frombuffer(stream, dtype=np.uint8))
+        for i, buffer in enumerate(buffers):
+            _write(archive, 'buffer{}'.format(i), np.frombuffer(buffer.raw(), dtype=np.uint8))
+    os.replace(temporary, file)
+
+def _write(archive, name, array):
+    info = zipfile.ZipInfo(name + '.npy', date_time=(1980, 1, 1, 0, 0, 0))
+    # Padding extra field: the .npy header is a multiple of ALIGNMENT, so the array data is aligned as well
+    size = LOCAL_HEADER_SIZE + len(info.filename.encode()) + 4 + ZIP64_EXTRA_SIZE
+    padding = -(archive.fp.tell() + size) % ALIGNMENT
+    info.extra = struct.pack('<HH', PADDING_EXTRA_ID, padding) + bytes(padding)
+    with archive.open(info, 'w', force_zip64=True) as f:
+        np.lib.format.write_array(f, array, allow_pickle=False)
+
+def readHeader(file):
+    # Header only (e.g. checked before the objects are loaded)
+    with zipfile.ZipFile(file) as archive:
+        return json.loads(_map(file, archive, 'header.npy').tobytes())
+
+def load(file):
+    # Returns (header, object)
+    with zipfile.ZipFile(file) as archive:
+        members = {name[:-len('.npy')]: _map(file, archive, name) for name in archive.namelist()}
+    header = json.loads(members.pop('header').tobytes())
+    stream = members.pop('objects')
+    buffers = [members['buffer{}'.format(i)] for i in range(len(members))]
+    return header, pickle.loads(stream, buffers=buffers)
+
+def _map(file, archive, name):
+    info = archive.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError('Compressed archive member: {} ({})'.format(name, file))
+    with open(file, 'rb') as f:
+        f.seek(info.header_offset)
+        nameSize, extraSize = struct.unpack('<HH', f.read(LOCAL_HEADER_SIZE)[26:30])
+        f.seek(info.header_offset + LOCAL_HEADER_SIZE + nameSize + extraSize)
+        version = np.lib.format.read_magic(f)
+        shape, fortran, dtype = (np.lib.format.read_array_header_1_0(f) if version == (1, 0)
+                                 else np.lib.format.read_array_header_2_0(f))
+        offset = f.tell()
+    if not np.prod(shape):
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(file, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran else 'C')
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Douglas Uba'
+
+import time
+import numpy as np
+from rayden import floats
+
+class BVH():
+    def __init__(self, lower, upper, leafSize=4):
+        # Build a bounding volume hierarchy over items given by their AABBs, (M, 3) arrays
+        start = time.perf_counter()
+        self.leafSize = leafSize
+        lower, upper = np.asarray(lower, dtype=np.float64), np.asarray(upper, dtype=np.float64)
+        self.lower, self.upper = [], []
+        self.left, self.right = [], []
+        self.start, self.count = [], []
+        self.items = np.arange(lower.shape[0])
+        depth = self.__build(lower, upper, (lower + upper) * 0.5) if lower.shape[0] else 0
+        self.lower, self.upper = np.array(self.lower).reshape(-1, 3), np.array(self.upper).reshape(-1, 3)
+        self.left, self.right = np.array(self.left, dtype=np.int64), np.array(self.right, dtype=np.int64)
+        self.start, self.count = np.array(self.start, dtype=np.int64), np.array(self.count, dtype=np.int64)
+        self.stats = {
+            'items': lower.shape[0],
+            'nodes': self.count.shape[0],
+            'leaves': int(np.count_nonzero(self.count)),
+            'depth': depth,
+            'buildTime': time.perf_counter() - start
+        }
+
+    def __newNode(self, lower, upper):
+        self.lower.append(lower)
+        self.upper.append(upper)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.start.append(0)
+        self.count.append(0)
+        return len(self.count) - 1
+
+    def __build(self, lower, upper, centroids):
+        depth = 0
+        # (node, first item, last item, depth), items in self.items[first:last]
+        stack = [(self.__newNode(None, None), 0, self.items.shape[0], 1)]
+        while stack:
+            node, first, last, level = stack.pop()
+            depth = max(depth, level)
+            items = self.items[first:last]
+            self.lower[node] = lower[items].min(axis=0)
+            self.upper[node] = upper[items].max(axis=0)
+            if last - first <= self.leafSize:
+                self.start[node], self.count[node] = first, last - first
+                continue
+            # Median split on the largest axis of the centroids
+            c = centroids[items]
+            axis = np.argmax(c.max(axis=0) - c.min(axis=0))
+            middle = (last - first) // 2
+            order = np.argpartition(c[:, axis], middle)
+            self.items[first:last] = items[order]
+            self.left[node] = self.__newNode(None, None)
+            self.right[node] = self.__newNode(None, None)
+            stack.append((self.right[node], first + middle, last, level + 1))
+            stack.append((self.left[node], first, first + middle, level + 1))
+        return depth
+
+    def __slabs(self, node, origin, inverse):
+        # Ray-box entry and exit distances
+        with np.errstate(invalid='ignore'):
+            t0 = (self.lower[node] - origin) * inverse
+            t1 = (self.upper[node] - origin) * inverse
+        tnear = np.fmax.reduce(np.fmin(t0, t1), axis=1)
+        tfar = np.fmin.reduce(np.fmax(t0, t1), axis=1)
+        return tnear, tfar
+
+    def intersect(self, origin, direction, leaf, nearest=None, ids=None, members=None, counters=None):
+        # Nearest hit per ray. leaf(items, rays) returns, for the given rays, the nearest distance
+        # among the items of a leaf, the item that was hit and its member (e.g. triangle of a mesh) or None
+        size = direction.shape[0]
+        nearest = floats.distances(size) if nearest is None else nearest
+        ids = np.full(size, -1) if ids is None else ids
+        members = np.full(size, -1) if members is None else members
+        if not self.count.shape[0]:
+            return nearest, ids, members
+        with np.errstate(divide='ignore'):
+            inverse = 1.0 / direction
+        stack = [(0, np.arange(size))]
+        while stack:
+            node, rays = stack.pop()
+            tnear, tfar = self.__slabs(node, origin[rays], inverse[rays])
+            if counters is not None:
+                counters['nodeTests'] += rays.shape[0]
+            rays = rays[(tnear <= tfar) & (tfar > 0.0) & (tnear < nearest[rays])]
+            if not rays.shape[0]:
+                continue
+            if self.count[node] == 0:
+                stack.append((self.right[node], rays))
+                stack.append((self.left[node], rays))
+                continue
+            items = self.items[self.start[node]:self.start[node] + self.count[node]]
+            if counters is not None:
+                counters['primitiveTests'] += rays.shape[0] * items.shape[0]
+            t, item, member = leaf(items, rays)
+            closer = t < nearest[rays]
+            nearest[rays[closer]] = t[closer]
+            ids[rays[closer]] = item[closer]
+            members[rays[closer]] = -1 if member is None else member[closer]
+        return nearest, ids, members
+
+    def occluded(self, origin, direction, maxDistance, leaf, occluded=None, counters=None):
+        # Any hit closer than maxDistance. leaf(items, rays, maxDistance) returns True for occluded rays.
+        size = direction.shape[0]
+        occluded = np.zeros(size, dtype=bool) if occluded is None else occluded
+        if not self.count.shape[0]:
+            return occluded
+        with np.errstate(divide='ignore'):
+            inverse = 1.0 / direction
+        stack = [(0, np.flatnonzero(~occluded))]
+        while stack:
+            node, rays = stack.pop()
+            # Skip rays that are already occluded
+            rays = rays[~occluded[rays]]
+            if not rays.shape[0]:
+                continue
+            tnear, tfar = self.__slabs(node, origin[rays], inverse[rays])
+            if counters is not None:
+                counters['nodeTests'] += rays.shape[0]
+            rays = rays[(tnear <= tfar) & (tfar > 0.0) & (tnear < maxDistance[rays])]
+            if not rays.shape[0]:
+                continue
+            if self.count[node] == 0:
+                stack.append((self.right[node], rays))
+                stack.append((self.left[node], rays))
+                continue
+            items = self.items[self.start[node]:self.start[node] + self.count[node]]
+            if counters is not None:
+                counters['primitiveTests'] += rays.shape[0] * items.shape[0]
+            occluded[rays[leaf(items, rays, maxDistance[rays])]] = True
+        return occluded
@@ -3,11 +3,12 @@
 __author__ = 'Douglas Uba'
 
 import numpy as np
+from rayden import floats
 from rayden.ray import Ray
 from rayden.vector import Vec3
 
 class Camera():
-    def __init__(self, eye, lookAt, up, width, height):
+    def __init__(self, eye, lookAt, up, width, height, aperture=0.0, focalDistance=None):
         # Camera parameters
         self.eye = eye
         self.lookAt = lookAt
@@ -20,19 +21,78 @@ class Camera():
         self.u = up.cross(self.direction).normalized()
         self.v = self.direction.cross(self.u)
         
-        # Build screen position
+        # Screen position of the columns and rows. Pixel positions (and rays) are built
+        # on demand from pixel indices, so memory is bounded by the number of requested pixels.
         res = float(self.width) / float(self.height)
         corners = (-1.0, 1.0/res + 0.25, 1.0, -1.0/res + 0.25)
-        self.x = np.tile(np.linspace(corners[0], corners[2], self.width), self.height)
-        self.y = np.repeat(np.linspace(corners[1], corners[3], self.height), self.width)
+        self.columns = np.linspace(corners[0], corners[2], self.width, dtype=floats.dtype())
+        self.rows = np.linspace(corners[1], corners[3], self.height, dtype=floats.dtype())
 
-        # Buil ray-direction (i.e. a vector from eye to screen plane)
-        self.eye2screen = (self.u * self.x) + (self.v * self.y) + self.direction
+        # Thin lens (depth of field)
+        self.setLens(aperture, focalDistance)
 
-    def getRays(self, sampling=False):
+    def setLens(self, aperture, focalDistance=None):
+        # Aperture diameter (0 for a pinhole camera) and distance of the plane in focus (lookAt, by default)
+        self.aperture = aperture
+        self.focalDistance = float((self.lookAt - self.eye).magnitude()) if focalDistance is None else focalDistance
+
+    def hasLens(self):
+        return self.aperture > 0.0
+
+    def __buildDirections(self, x, y):
+        # Ray-direction (i.e. a vector from eye to screen plane)
+        return (self.u * x) + (self.v * y) + self.direction
+
+    def getTiles(self, tileSize):
+        # Image regions (x0, y0, x1, y1), row by row
+        return [(x0, y0, min(x0 + tileSize, self.width), min(y0 + tileSize, self.height))
+                for y0 in range(0, self.height, tileSize)
+                for x0 in range(0, self.width, tileSize)]
+
+    def getTilePixels(self, tile):
+        x0, y0, x1, y1 = tile
+        return (np.arange(y0, y1)[:, np.newaxis] * self.width + np.arange(x0, x1)).ravel()
+
+    def getScreen(self, pixels=None):
+        # Screen position of pixels given by their indices (row-major), all of them by default
+        if pixels is None:
+            pixels = np.arange(self.width * self.height)
+        return self.columns[pixels % self.width], self.rows[pixels // self.width]
+
+    def getRays(self, sampling=False, pixels=None, jitter=None, lens=None, rng=None):
+        # rng: random generator of the samples that are not given (a new one, by default)
+        rng = np.random.default_rng() if rng is None else rng
+        eye2screen = self.__buildDirections(*self.getScreen(pixels))
         if not sampling:
-            return Ray(self.eye, self.eye2screen)
-        # Generate random samples
-        rx = np.random.random(self.eye2screen.x.shape)/self.width
-        ry = np.random.random(self.eye2screen.y.shape)/self.height
-        return Ray(self.eye, Vec3(self.eye2screen.x + rx, self.eye2screen.y + ry, self.eye2screen.z))
+            return Ray(self.eye, eye2screen)
+        # Jitter (u, v) in [0, 1) per pixel, random if not given
+        if jitter is None:
+            jitter = (rng.random(eye2screen.x.shape), rng.random(eye2screen.y.shape))
+        rx = jitter[0]/self.width
+        ry = jitter[1]/self.height
+        direction = Vec3(eye2screen.x + rx, eye2screen.y + ry, eye2screen.z)
+        if not self.hasLens():
+            return Ray(self.eye, direction)
+        return self.__thinLens(direction, lens, rng)
+
+    def __thinLens(self, direction, lens, rng):
+        # Each ray leaves its own point of the aperture (lens samples (u, v) in [0, 1), random if not given)
+        # towards the point of the pinhole ray on the plane in focus
+        if lens is None:
+            lens = (rng.random(direction.x.shape), rng.random(direction.y.shape))
+        lx, ly = self.__concentricDisk(*lens)
+        radius = 0.5 * self.aperture
+        origin = self.eye + self.u * (radius * lx) + self.v * (radius * ly)
+        focus = self.eye + direction * (self.focalDistance / direction.dot(self.direction))
+        return Ray(origin, focus - origin)
+
+    @staticmethod
+    def __concentricDisk(u, v):
+        # Uniform samples of the square to the unit disk, preserving strata (Shirley and Chiu)
+        x, y = 2.0 * np.asarray(u) - 1.0, 2.0 * np.asarray(v) - 1.0
+        horizontal = np.abs(x) > np.abs(y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = np.where(horizontal, x, y)
+            theta = np.where(horizontal, (np.pi / 4.0) * (y / x), (np.pi / 2.0) - (np.pi / 4.0) * (x / y))
+        theta = np.where(r == 0.0, 0.0, theta)
+        return (r * np.cos(theta)).astype(floats.dtype()), (r * np.sin(theta)).astype(floats.dtype())
@@ -4,28 +4,67 @@ __author__ = 'Douglas Uba'
 
 from colour import Color
 import numpy as np
+from rayden.utils import apply, column, inplace, pack
+
+# Relative luminance weights (r, g, b)
+LUMINANCE = np.array((0.2126, 0.7152, 0.0722))
 
 class RGB():
+    # Channels packed in a single contiguous array: (N, 3) for N colors or (3,) for a single one
+    __slots__ = ('data',)
+
     def __init__(self, r=1.0, g=1.0, b=1.0):
-        (self.r, self.g, self.b) = (r, g, b)
-        
+        self.data = pack(r, g, b)
+
+    @staticmethod
+    def fromArray(data):
+        # Wraps an (N, 3) or (3,) array, without copying
+        c = RGB.__new__(RGB)
+        c.data = data
+        return c
+
     @staticmethod
     def fromName(name):
         color = Color(name)
         return RGB(color.red, color.green, color.blue)
 
+    def __channel(self, k):
+        return self.data[k] if self.data.ndim == 1 else self.data[:, k]
+
+    r = property(lambda self: self.__channel(0))
+    g = property(lambda self: self.__channel(1))
+    b = property(lambda self: self.__channel(2))
+
+    def add(self, other, out=None):
+        return apply(RGB, np.add, self.data, other.data, out)
+
+    def mul(self, other, out=None):
+        return apply(RGB, np.multiply, self.data, column(other), out)
+
     def __add__(self, other):
-        return RGB(self.r + other.r, self.g + other.g, self.b + other.b)
+        return self.add(other)
 
     def __mul__(self, other):
-        return RGB(self.r * other, self.g * other, self.b * other)
-
-    def place(self, cond):
-        r = RGB(np.zeros(cond.shape), np.zeros(cond.shape), np.zeros(cond.shape))
-        np.place(r.r, cond, self.r)
-        np.place(r.g, cond, self.g)
-        np.place(r.b, cond, self.b)
-        return r
+        return self.mul(other)
+
+    def __iadd__(self, other):
+        return inplace(self, np.add, other.data)
+
+    def __imul__(self, other):
+        return inplace(self, np.multiply, column(other))
+
+    def copy(self):
+        return RGB.fromArray(self.data.copy())
+
+    def tile(self, reps):
+        return self.copy() if self.data.ndim == 1 else RGB.fromArray(np.tile(self.data, (reps, 1)))
+
+    def mean(self, reps):
+        # Mean over reps blocks of a tiled color
+        return self.copy() if self.data.ndim == 1 else RGB.fromArray(self.data.reshape(reps, -1, 3).mean(axis=0))
+
+    def luminance(self):
+        return self.data @ LUMINANCE
 
     def components(self):
         return (self.r, self.g, self.b)
@@ -3,12 +3,16 @@
 __author__ = 'Douglas Uba'
 
 import sys
+import numpy as np
 
 # Define EPSILON for numeric precision
 EPSILON = sys.float_info.epsilon
 
-# Define MAX_DISTANCE value
-MAX_DISTANCE = sys.float_info.max
+# EPSILON for single-precision renders (coordinates are only accurate to ~1e-7 relative)
+FLOAT32_EPSILON = 1e-4
+
+# Define MAX_DISTANCE value (largest single-precision value, so it is the same sentinel in both precisions)
+MAX_DISTANCE = float(np.finfo(np.float32).max)
 
 # Define AIR_REFRACTION_INDEX value
 AIR_REFRACTION_INDEX = 1.000293
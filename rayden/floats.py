@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Douglas Uba'
+
+# Floating-point precision of the render (rays, vectors, colors, primitives and frame buffer).
+# The quartic solver (torus) always works in double precision.
+
+import numpy as np
+from rayden.constants import EPSILON, FLOAT32_EPSILON, MAX_DISTANCE
+
+# Available precisions
+FLOAT64 = 'float64'
+FLOAT32 = 'float32'
+
+_precision = FLOAT64
+_dtype = np.float64
+
+def setPrecision(precision):
+    global _precision, _dtype
+    if precision not in (FLOAT64, FLOAT32):
+        raise ValueError('Unknown precision: {}'.format(precision))
+    _precision = precision
+    _dtype = np.dtype(precision).type
+
+def getPrecision():
+    return _precision
+
+def dtype():
+    return _dtype
+
+def epsilon():
+    # Minimum hit distance (avoids self-intersections)
+    return EPSILON if _precision == FLOAT64 else FLOAT32_EPSILON
+
+def distances(size):
+    # Nearest distance per ray, initialized with the sentinel (no hit)
+    return np.full(size, MAX_DISTANCE, dtype=_dtype)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Douglas Uba'
+
+from multiprocessing import shared_memory
+import numpy as np
+from PIL import Image
+
+class FrameBuffer():
+    def __init__(self, width, height, name=None, dtype=np.float64):
+        self.width = width
+        self.height = height
+        self.dtype = np.dtype(dtype)
+        # Create a new accumulation buffer or attach to an existing one (e.g. from a worker process)
+        create = name is None
+        size = height * width * 4 * self.dtype.itemsize
+        self.memory = shared_memory.SharedMemory(name=name, create=create, size=size)
+        # Color sums (height, width, 3) followed by the number of samples per pixel (height, width)
+        self.data = np.ndarray((height, width, 3), dtype=self.dtype, buffer=self.memory.buf)
+        self.samples = np.ndarray((height, width), dtype=self.dtype, buffer=self.memory.buf, offset=self.data.nbytes)
+        if create:
+            self.data.fill(0.0)
+            self.samples.fill(0.0)
+
+    def getName(self):
+        return self.memory.name
+
+    def accumulate(self, tile, color, index=None):
+        # Add one sample (flat, row by row) into the tile region, in place.
+        # If index is given, color holds only those pixels (flat indices inside the tile).
+        x0, y0, x1, y1 = tile
+        region, samples = self.data[y0:y1, x0:x1], self.samples[y0:y1, x0:x1]
+        if index is None:
+            region += np.reshape(color.data, region.shape) if color.data.ndim == 2 else color.data
+            samples += 1.0
+            return
+        rows, cols = np.divmod(index, x1 - x0)
+        region[rows, cols] += color.data
+        samples[rows, cols] += 1.0
+
+    def toImage(self):
+        weight = 1.0 / np.maximum(self.samples, 1.0)
+        channels = [Image.fromarray((255 * np.clip(self.data[:, :, k] * weight, 0, 1)).astype(np.uint8), 'L') for k in range(3)]
+        return Image.merge('RGB', channels)
+
+    def close(self):
+        # Release the views before closing the shared memory block
+        self.data, self.samples = None, None
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.unlink()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Douglas Uba'
+
+# Compiled (numba) intersection kernels.
+# Each kernel tests rays (N, 3) against a list of members and updates, in place,
+# the nearest distance and the hit member of each ray. Hits closer than eps are ignored.
+
+import math
+import numpy as np
+from rayden import floats
+from rayden.constants import EPSILON
+
+try:
+    from numba import njit, prange, set_num_threads
+    from rayden.math import fqs
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Available backends
+NUMPY = 'numpy'
+NUMBA = 'numba'
+
+_backend = NUMPY
+
+def setBackend(backend):
+    global _backend
+    if backend not in (NUMPY, NUMBA):
+        raise ValueError('Unknown backend: {}'.format(backend))
+    if backend == NUMBA and not NUMBA_AVAILABLE:
+        raise ValueError('The numba backend requires numba')
+    _backend = backend
+
+def getBackend():
+    return _backend
+
+def isCompiled():
+    return _backend == NUMBA
+
+def setThreads(threads):
+    # Threads of the parallel kernels
+    if NUMBA_AVAILABLE:
+        set_num_threads(threads)
+
+def buffers(size):
+    # Nearest distance and hit member, per ray
+    return floats.distances(size), np.full(size, -1, dtype=np.int64)
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, nogil=True, cache=True)
+    def intersectSpheres(origin, direction, centers, radii, members, nearest, ids, eps):
+        for i in prange(direction.shape[0]):
+            ox, oy, oz = origin[i, 0], origin[i, 1], origin[i, 2]
+            dx, dy, dz = direction[i, 0], direction[i, 1], direction[i, 2]
+            for m in members:
+                cx, cy, cz = ox - centers[m, 0], oy - centers[m, 1], oz - centers[m, 2]
+                b = 2.0 * (dx * cx + dy * cy + dz * cz)
+                c = cx * cx + cy * cy + cz * cz - radii[m] * radii[m]
+                disc = b * b - 4.0 * c
+                if disc < 0.0:
+                    continue
+                sq = math.sqrt(disc)
+                h0 = (-b - sq) * 0.5
+                h1 = (-b + sq) * 0.5
+                h = h0 if (h0 > 0.0 and h0 < h1) else h1
+                if h > eps and h < nearest[i]:
+                    nearest[i] = h
+                    ids[i] = m
+
+    @njit(parallel=True, nogil=True, cache=True)
+    def intersectPlanes(origin, direction, normals, distances, members, nearest, ids, eps):
+        for i in prange(direction.shape[0]):
+            for m in members:
+                c = direction[i, 0] * normals[m, 0] + direction[i, 1] * normals[m, 1] + direction[i, 2] * normals[m, 2]
+                if abs(c) <= EPSILON:
+                    continue
+                o = origin[i, 0] * normals[m, 0] + origin[i, 1] * normals[m, 1] + origin[i, 2] * normals[m, 2]
+                t = -1.0 * ((o + distances[m]) / c)
+                if t >= eps and t < nearest[i]:
+                    nearest[i] = t
+                    ids[i] = m
+
+    @njit(parallel=True, nogil=True, cache=True)
+    def intersectTriangles(origin, direction, a, edge1, edge2, members, nearest, ids, eps):
+        # Moller-Trumbore
+        for i in prange(direction.shape[0]):
+            dx, dy, dz = direction[i, 0], direction[i, 1], direction[i, 2]
+            for m in members:
+                e1x, e1y, e1z = edge1[m, 0], edge1[m, 1], edge1[m, 2]
+                e2x, e2y, e2z = edge2[m, 0], edge2[m, 1], edge2[m, 2]
+                hx, hy, hz = dy * e2z - dz * e2y, dz * e2x - dx * e2z, dx * e2y - dy * e2x
+                delta = e1x * hx + e1y * hy + e1z * hz
+                if delta > -EPSILON and delta < EPSILON:
+                    continue
+                f = 1.0 / delta
+                sx, sy, sz = origin[i, 0] - a[m, 0], origin[i, 1] - a[m, 1], origin[i, 2] - a[m, 2]
+                u = f * (sx * hx + sy * hy + sz * hz)
+                if u < 0.0 or u > 1.0:
+                    continue
+                qx, qy, qz = sy * e1z - sz * e1y, sz * e1x - sx * e1z, sx * e1y - sy * e1x
+                v = f * (dx * qx + dy * qy + dz * qz)
+                if v < 0.0 or u + v > 1.0:
+                    continue
+                t = f * (e2x * qx + e2y * qy + e2z * qz)
+                if t > eps and t < nearest[i]:
+                    nearest[i] = t
+                    ids[i] = m
+
+    @njit(parallel=True, nogil=True, cache=True)
+    def intersectTorus(origin, direction, sweptRadius, tubeRadius, nearest, ids, eps):
+        # Torus centered at the origin, around the y-axis (single member), solved in double precision
+        four_a_sqrd = 4.0 * sweptRadius * sweptRadius
+        radius = sweptRadius + tubeRadius
+        for i in prange(direction.shape[0]):
+            ox, oy, oz = np.float64(origin[i, 0]), np.float64(origin[i, 1]), np.float64(origin[i, 2])
+            dx, dy, dz = np.float64(direction[i, 0]), np.float64(direction[i, 1]), np.float64(direction[i, 2])
+            # Bounding sphere rejection (radius sweptRadius + tubeRadius, at the origin)
+            b = ox * dx + oy * dy + oz * dz
+            disc = b * b - (ox * ox + oy * oy + oz * oz - radius * radius)
+            if disc < 0.0:
+                continue
+            sq = math.sqrt(disc)
+            if -b + sq <= eps:
+                continue
+            # Start the ray at the bounding sphere (better conditioned quartic)
+            start = max(-b - sq, 0.0)
+            ox, oy, oz = ox + dx * start, oy + dy * start, oz + dz * start
+            sum_d_sqrd = dx * dx + dy * dy + dz * dz
+            e = ox * ox + oy * oy + oz * oz - sweptRadius * sweptRadius - tubeRadius * tubeRadius
+            f = ox * dx + oy * dy + oz * dz
+            root = fqs.single_min_positive_real_root_quartic(sum_d_sqrd * sum_d_sqrd,
+                                                             4.0 * sum_d_sqrd * f,
+                                                             2.0 * sum_d_sqrd * e + 4.0 * f * f + four_a_sqrd * dy * dy,
+                                                             4.0 * f * e + 2.0 * four_a_sqrd * oy * dy,
+                                                             e * e - four_a_sqrd * (tubeRadius * tubeRadius - oy * oy),
+                                                             eps)
+            t = root + start
+            if t > eps and t < nearest[i]:
+                nearest[i] = t
+                ids[i] = 0
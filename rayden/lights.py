@@ -4,6 +4,7 @@ __author__ = 'Douglas Uba'
 
 from abc import ABC, abstractmethod
 import numpy as np
+from rayden.utils import column
 from rayden.vector import Vec3
 
 class AbstractLightSource(ABC):
@@ -12,16 +13,29 @@ class AbstractLightSource(ABC):
         self.watts = watts
 
     @abstractmethod
-    def getPosition(self):
+    def getPosition(self, rng=None):
         pass
 
+    @abstractmethod
+    def sample(self, n, strata=1, uv=None, rng=None):
+        # Returns (strata x n) positions, sample-major, and the matching pdf (area measure).
+        # uv: (u, v) sampler values in [0, 1) per position. Random (from rng or a new generator), if not given.
+        pass
+
+    def getArea(self):
+        return 1.0
+
 class PointLightSource(AbstractLightSource):
     def __init__(self, position, color, watts=100.0):
         super().__init__(color, watts)
         self.position = position
 
-    def getPosition(self):
+    def getPosition(self, rng=None):
         return self.position
+
+    def sample(self, n, strata=1, uv=None, rng=None):
+        # Delta light: same position for every ray
+        return self.position, 1.0
         
 class AreaLightSource(AbstractLightSource):
     def __init__(self, color, watts, a, b, c, d):
@@ -30,16 +44,31 @@ class AreaLightSource(AbstractLightSource):
         self.edge01 = a - b
         self.edge02 = a - c
         self.edge03 = a - d
+        self.area = self.edge01.cross(self.edge03).magnitude()
 
-    def getPosition(self):
+    def getArea(self):
+        return self.area
+
+    def getPosition(self, rng=None):
+        rng = np.random.default_rng() if rng is None else rng
         return self.__generatePosition(1.0, self.vertices[2],
-                                      np.random.random_sample(), self.edge01,
-                                      np.random.random_sample(), self.edge03)
-        
+                                      rng.random(), self.edge01,
+                                      rng.random(), self.edge03)
+
+    def sample(self, n, strata=1, uv=None, rng=None):
+        # Uniform on the rectangle: a different position per ray, stratified among the strata of each ray
+        rng = np.random.default_rng() if rng is None else rng
+        u, v = (self.__stratify(n, strata, rng), self.__stratify(n, strata, rng)) if uv is None else uv
+        position = self.__generatePosition(1.0, self.vertices[2], u, self.edge01, v, self.edge03)
+        return position, np.full(n * strata, 1.0/self.area)
+
+    @staticmethod
+    def __stratify(n, strata, rng):
+        # Latin hypercube (N-rooks): each ray gets one sample per stratum, in random order
+        index = np.argsort(rng.random((strata, n)), axis=0)
+        return ((index + rng.random((strata, n))) / strata).ravel()
+
     def __generatePosition(self, a, v1, b, v2, c, v3):
-        pos = Vec3()
-        pos.x = a * v1.x + b * v2.x + c * v3.x
-        pos.y = a * v1.y + b * v2.y + c * v3.y
-        pos.z = a * v1.z + b * v2.z + c * v3.z
-        return pos
+        position = column(a) * v1.data + column(b) * v2.data + column(c) * v3.data
+        return Vec3.fromArray(position.astype(v1.data.dtype, copy=False))
         
\ No newline at end of file
@@ -4,9 +4,12 @@ __author__ = 'Douglas Uba'
 
 from abc import ABC, abstractmethod
 import numpy as np
+from rayden import floats
 from rayden.color import RGB
 from rayden.constants import AIR_REFRACTION_INDEX
-from rayden.noise.simplexnoise import raw_noise_3d, scaled_octave_noise_3d
+from rayden.noise.vectorized import raw_noise_3d, scaled_octave_noise_3d
+from rayden.noise.volume import NoiseVolume
+from rayden.utils import column
 from rayden.vector import Vec3
 
 class Material():
@@ -50,8 +53,8 @@ class Material():
         return material
 
     @staticmethod
-    def mirror(color=RGB.fromName('black')):
-        material = Material(color)
+    def mirror(color=None):
+        material = Material(RGB.fromName('black') if color is None else color)
         material.specular = RGB(0.05, 0.05, 0.05)
         material.shininess = 200.0
         material.reflectivity = 1.0
@@ -66,67 +69,89 @@ class Material():
         return material
 
 class Checkerboard(Material):
-    def __init__(self, color1=RGB.fromName('white'), color2=RGB.fromName('black'), scale=6.0):
+    # Default colors are built by the constructor, in the precision that is set at that time
+    def __init__(self, color1=None, color2=None, scale=6.0):
         super().__init__(None)
-        self.color1 = color1
-        self.color2 = color2
+        self.color1 = RGB.fromName('white') if color1 is None else color1
+        self.color2 = RGB.fromName('black') if color2 is None else color2
         self.scale = scale
 
     def getColors(self, p):
         sines = np.sin(self.scale * p.x) * np.sin(self.scale * p.y) * np.sin(self.scale * p.z)
-        r = np.where(sines < 0, self.color1.r, self.color2.r)
-        g = np.where(sines < 0, self.color1.g, self.color2.g)
-        b = np.where(sines < 0, self.color1.b, self.color2.b)
-        return RGB(r, g, b), self.specular
-
-class NormalMap():
+        return RGB.fromArray(np.where(column(sines < 0), self.color1.data, self.color2.data)), self.specular
+
+class Procedural(ABC):
+    # Noise field of procedural textures, evaluated at the hit points or sampled from a baked volume
+    def __init__(self):
+        self.volume = None
+
+    @abstractmethod
+    def field(self, x, y, z):
+        # Noise value at points given by their coordinates (arrays)
+        pass
+
+    def getParameters(self):
+        # Parameters that change the field (baked volume keys)
+        return (type(self).__name__, self.scale)
+
+    def bake(self, lower, upper, resolution, directory=None):
+        # Bakes the field over the box [lower, upper] (e.g. primitive bounds) into a noise volume
+        self.volume = NoiseVolume.bake(self.field, lower, upper, resolution, directory, self.getParameters())
+
+    def noise(self, p):
+        # Computed for every batch of hit points (each batch is shaded once), in the render precision
+        if self.volume is not None:
+            noise = self.volume.sample(p.x, p.y, p.z)
+        else:
+            noise = self.field(p.x, p.y, p.z)
+        return np.asarray(noise).astype(floats.dtype(), copy=False)
+
+class NormalMap(Procedural):
     def __init__(self, scale, amount):
+        super().__init__()
         self.scale = scale
         self.amount = amount
-        self.noise = np.zeros(0)
-    
+
+    def field(self, x, y, z):
+        return raw_noise_3d(x * self.scale, y * self.scale, z * self.scale)
+
     def modify(self, normal, p):
-        if(p.x.shape[0] != self.noise.shape[0]):
-            scaled = p * self.scale
-            self.noise = []
-            for x, y, z in zip(scaled.x, scaled.y, scaled.z):
-                self.noise.append(raw_noise_3d(x, y, z))
-            self.noise = np.array(self.noise)
-        return (normal + Vec3(self.noise, self.noise, self.noise) * self.amount).normalized()
-
-class Wood(Material):
-    def __init__(self, color1=RGB(0.1043, 0.0737, 0.0517), color2=RGB(0.4215, 0.2686, 0.1888), scale=10.0):
-        super().__init__(None)
-        self.color1 = color1
-        self.color2 = color2
+        noise = self.noise(p)
+        return (normal + Vec3(noise, noise, noise) * self.amount).normalized()
+
+class Wood(Material, Procedural):
+    def __init__(self, color1=None, color2=None, scale=10.0):
+        Material.__init__(self, None)
+        Procedural.__init__(self)
+        self.color1 = RGB(0.1043, 0.0737, 0.0517) if color1 is None else color1
+        self.color2 = RGB(0.4215, 0.2686, 0.1888) if color2 is None else color2
         self.scale = scale
-        self.noise = np.zeros(0)
+
+    def field(self, x, y, z):
+        # Rings are the fractional part, taken after the lookup (it is not continuous)
+        return raw_noise_3d(x * self.scale, y * self.scale, z * self.scale) * 5.0
 
     def getColors(self, p):
-        if(p.x.shape[0] != self.noise.shape[0]):
-            scaled = p * self.scale
-            self.noise = []
-            for x, y, z in zip(scaled.x, scaled.y, scaled.z):
-                self.noise.append(raw_noise_3d(x, y, z) * 5.0)
-            self.noise = np.array(self.noise)
-            self.noise = self.noise - self.noise.astype(np.int)
-        return self.color1 * self.noise + self.color2 * (1.0 - self.noise), self.specular
-
-class Turbulence(Material):
-    def __init__(self, color1=RGB(1.0, 1.0, 1.0), color2=RGB(0.0, 0.0, 1.0), scale=8.0):
-        super().__init__(None)
-        self.color1 = color1
-        self.color2 = color2
+        noise = self.noise(p)
+        noise = noise - np.trunc(noise)
+        return self.color1 * noise + self.color2 * (1.0 - noise), self.specular
+
+class Turbulence(Material, Procedural):
+    def __init__(self, color1=None, color2=None, scale=8.0):
+        Material.__init__(self, None)
+        Procedural.__init__(self)
+        self.color1 = RGB(1.0, 1.0, 1.0) if color1 is None else color1
+        self.color2 = RGB(0.0, 0.0, 1.0) if color2 is None else color2
         self.scale = scale
         self.numberOfOctaves = 4
-        self.noise = np.zeros(0)
+
+    def field(self, x, y, z):
+        return scaled_octave_noise_3d(self.numberOfOctaves, 0.5, 1.0, 0.0, 1.0,
+                                      x * self.scale, y * self.scale, z * self.scale)
+
+    def getParameters(self):
+        return super().getParameters() + (self.numberOfOctaves,)
 
     def getColors(self, p):
-        if(p.x.shape[0] != self.noise.shape[0]):
-            scaled = p * self.scale
-            self.noise = []
-            for x, y, z in zip(scaled.x, scaled.y, scaled.z):
-                self.noise.append(scaled_octave_noise_3d(self.numberOfOctaves, 0.5, 1.0, 0.0, 1.0, x, y, z))
-            self.noise = np.array(self.noise)
-        return self.color1 * self.noise + self.color2 * (1.0 - self.noise), self.specular
-       
+        noise = self.noise(p)
+        return self.color1 * noise + self.color2 * (1.0 - noise), self.specular
@@ -7,7 +7,7 @@ Created on Fri Jan  4 13:50:23 2019
 
 import math, cmath
 import numpy as np
-from numba import jit
+from numba import jit, prange
 
 
 @jit(nopython=True)
@@ -537,3 +537,448 @@ def quartic_roots(p):
     else:
         roots = multi_quartic(*p.T)
         return np.array(roots).T
+
+
+# -----------------------------------------------------------------------------
+# Smallest positive real root (real arithmetic only)
+# -----------------------------------------------------------------------------
+
+@jit(nopython=True)
+def single_real_cubic_roots(a, b, c):
+    ''' Real roots of a single monic cubic equation, in real arithmetic.
+
+    Parameters
+    ----------
+    a, b, c: float
+        Coefficients of the monic Cubic polynomial::
+
+            x^3 + a*x^2 + b*x + c = 0
+
+    Returns
+    -------
+    r1, r2, r3: tuple
+        The real roots of the polynomial; `r2` and `r3` are `nan` when the
+        polynomial has a single real root. `r1` is the largest root.
+    '''
+    third = 1./3.
+    a13 = a*third
+    f = b - a*a13
+    g = 2.*a13*a13*a13 - b*a13 + c
+    h = 0.25*g*g + f*f*f/27.
+
+    # Double roots may come out with a slightly positive h (relative to the
+    # magnitude of the roots, k2)
+    k2 = a13*a13 + abs(b)*third + np.cbrt(c)**2
+    if h > 1e-12*k2*k2*k2 or f == 0:
+        sqrt_h = math.sqrt(max(h, 0.))
+        r1 = np.cbrt(-0.5*g + sqrt_h) + np.cbrt(-0.5*g - sqrt_h) - a13
+        return r1, np.nan, np.nan
+
+    j = 2.*math.sqrt(-f*third)
+    k = math.acos(min(max(1.5*g/f*math.sqrt(-3./f), -1.), 1.))*third
+    r1 = j*math.cos(k) - a13
+    r2 = j*math.cos(k - 2.*math.pi*third) - a13
+    r3 = j*math.cos(k - 4.*math.pi*third) - a13
+    return r1, r2, r3
+
+
+@jit(nopython=True)
+def single_polish(x, p, steps=1):
+    ''' Newton polishing of a root `x` of the polynomial with coefficients
+    `p` (highest degree first). A step is kept only if it lowers the
+    residual, since the slope vanishes at multiple roots.
+    '''
+    value = 0.
+    for ci in p:
+        value = value*x + ci
+    for i in range(steps):
+        slope = 0.
+        n = len(p) - 1
+        for ci in p[:-1]:
+            slope = slope*x + n*ci
+            n -= 1
+        if slope == 0:
+            break
+        polished = x - value/slope
+        residual = 0.
+        for ci in p:
+            residual = residual*polished + ci
+        if abs(residual) >= abs(value):
+            break
+        x, value = polished, residual
+    return x
+
+
+@jit(nopython=True)
+def single_min_positive_real_root_cubic(a0, b0, c0, d0, eps=0.):
+    ''' Smallest real root larger than `eps` of a single cubic equation.
+
+    Parameters
+    ----------
+    a0, b0, c0, d0: float
+        Input data are coefficients of the Cubic polynomial::
+
+            a0*x^3 + b0*x^2 + c0*x + d0 = 0
+
+    eps: float, optional
+        Roots smaller than or equal to `eps` are discarded.
+
+    Returns
+    -------
+    root: float
+        Output data is the smallest real root larger than `eps`, or `inf`
+        if there is none.
+    '''
+    roots = single_real_cubic_roots(b0/a0, c0/a0, d0/a0)
+    root = np.inf
+    for r in roots:
+        if r > eps and r < root:
+            root = r
+    if root == np.inf:
+        return root
+    root = single_polish(root, (a0, b0, c0, d0))
+    return root if root > eps else np.inf
+
+
+@jit(nopython=True)
+def single_min_positive_real_root_quartic(a0, b0, c0, d0, e0, eps=0.):
+    ''' Smallest real root larger than `eps` of a single quartic equation,
+    by Ferrari's method in real arithmetic.
+
+    Parameters
+    ----------
+    a0, b0, c0, d0, e0: float
+        Input data are coefficients of the Quartic polynomial::
+
+            a0*x^4 + b0*x^3 + c0*x^2 + d0*x + e0 = 0
+
+    eps: float, optional
+        Roots smaller than or equal to `eps` are discarded.
+
+    Returns
+    -------
+    root: float
+        Output data is the smallest real root larger than `eps`, or `inf`
+        if there is none.
+    '''
+    a, b, c, d = b0/a0, c0/a0, d0/a0, e0/a0
+
+    # Depressed quartic y^4 + p*y^2 + q*y + r = 0, with x = y - a/4
+    a4 = 0.25*a
+    a2 = a*a
+    p = b - 0.375*a2
+    q = c - 0.5*a*b + 0.125*a2*a
+    r = d - 0.25*a*c + 0.0625*a2*b - 0.01171875*a2*a2
+
+    # Largest real root of the resolvent cubic, polished by a Newton step
+    B, C, D = p, 0.25*p*p - r, -0.125*q*q
+    m = single_polish(single_real_cubic_roots(B, C, D)[0], (1., B, C, D))
+    m = max(m, 0.)
+
+    # Two quadratics y^2 -/+ s*y + (p/2 + m +/- q/(2s)) = 0, with s = sqrt(2m)
+    s = math.sqrt(2.*m)
+    half = 0.5*p + m
+    root = np.inf
+    for sign in (-1., 1.):
+        if s < 1e-12:
+            # Biquadratic: y^2 = (-p +/- sqrt(p^2 - 4r))/2
+            y2 = 0.5*(-p + sign*math.sqrt(max(p*p - 4.*r, 0.)))
+            if y2 < 0:
+                continue
+            ys = (-math.sqrt(y2), math.sqrt(y2))
+        else:
+            delta = s*s - 4.*(half - sign*0.5*q/s)
+            # Double roots may come out slightly negative
+            if delta < -1e-9*(s*s + abs(half) + 1.):
+                continue
+            sqrt_delta = math.sqrt(max(delta, 0.))
+            ys = (0.5*(-sign*s - sqrt_delta), 0.5*(-sign*s + sqrt_delta))
+        for y in ys:
+            x = y - a4
+            if x > eps and x < root:
+                root = x
+    if root == np.inf:
+        return root
+    root = single_polish(root, (a0, b0, c0, d0, e0))
+    return root if root > eps else np.inf
+
+
+def multi_real_cubic_roots(a, b, c, all_roots=True):
+    ''' Real roots of multiple monic cubic equations, based on `numpy`
+    functions, in real arithmetic.
+
+    Parameters
+    ----------
+    a, b, c: array_like
+        Coefficients of the monic Cubic polynomials::
+
+            x^3 + a*x^2 + b*x + c = 0
+
+    all_roots: bool, optional
+        If set to `True` (default) all three roots are computed and returned.
+        If set to `False` only the largest real root is computed and returned.
+
+    Returns
+    -------
+    roots: ndarray
+        Output data is an array of size (3, M) with the real roots of the
+        given polynomials; rows 1 and 2 are `nan` for polynomials with a
+        single real root. Row 0 holds the largest root. If `all_roots=False`
+        only the largest root is returned, of size (M,).
+    '''
+    third = 1./3.
+    a13 = a*third
+    f = b - a*a13
+    g = 2.*a13*a13*a13 - b*a13 + c
+    h = 0.25*g*g + f*f*f/27.
+
+    # Double roots may come out with a slightly positive h (relative to the
+    # magnitude of the roots, k2)
+    k2 = a13*a13 + np.abs(b)*third + np.cbrt(c)**2
+    one = (h > 1e-12*k2*k2*k2) | (f == 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sqrt_h = np.sqrt(np.maximum(h, 0.))
+        r = np.cbrt(-0.5*g + sqrt_h) + np.cbrt(-0.5*g - sqrt_h) - a13
+        j = 2.*np.sqrt(np.maximum(-f*third, 0.))
+        k = np.arccos(np.clip(1.5*g/f*np.sqrt(-3./f), -1., 1.))*third
+
+    if not all_roots:
+        return np.where(one, r, j*np.cos(k) - a13)
+
+    roots = np.empty((3,) + np.shape(r))
+    for i in range(3):
+        roots[i] = np.where(one, r if i == 0 else np.nan, j*np.cos(k - 2.*i*math.pi*third) - a13)
+    return roots
+
+
+def multi_polish(x, p, steps=1):
+    ''' Newton polishing of roots `x` of multiple polynomials, given by the
+    sequence of coefficient arrays `p` (highest degree first). Steps are
+    kept only where they lower the residual, since the slope vanishes at
+    multiple roots.
+    '''
+    def evaluate(x):
+        value = np.zeros_like(x)
+        for ci in p:
+            value = value*x + ci
+        return value
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = evaluate(x)
+        for i in range(steps):
+            slope = np.zeros_like(x)
+            for n, ci in zip(range(len(p) - 1, 0, -1), p[:-1]):
+                slope = slope*x + n*ci
+            polished = x - value/slope
+            residual = evaluate(polished)
+            better = np.abs(residual) < np.abs(value)
+            x, value = np.where(better, polished, x), np.where(better, residual, value)
+    return x
+
+
+def multi_min_positive_real_root_cubic(a0, b0, c0, d0, eps=0.):
+    ''' Smallest real root larger than `eps` of multiple cubic equations,
+    based on `numpy` functions, in real arithmetic.
+
+    Parameters
+    ----------
+    a0, b0, c0, d0: array_like
+        Input data are coefficients of the Cubic polynomial::
+
+            a0*x^3 + b0*x^2 + c0*x + d0 = 0
+
+    eps: float, optional
+        Roots smaller than or equal to `eps` are discarded.
+
+    Returns
+    -------
+    roots: ndarray
+        Output data is an array of size (M,) with the smallest real root
+        larger than `eps` of each polynomial, or `inf` if there is none.
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        roots = multi_real_cubic_roots(b0/a0, c0/a0, d0/a0)
+    roots[~(roots > eps)] = np.inf
+    root = multi_polish(roots.min(axis=0), (a0, b0, c0, d0))
+    return np.where(root > eps, root, np.inf)
+
+
+def multi_min_positive_real_root_quartic(a0, b0, c0, d0, e0, eps=0.):
+    ''' Smallest real root larger than `eps` of multiple quartic equations,
+    based on `numpy` functions, by Ferrari's method in real arithmetic.
+
+    Parameters
+    ----------
+    a0, b0, c0, d0, e0: array_like
+        Input data are coefficients of the Quartic polynomial::
+
+            a0*x^4 + b0*x^3 + c0*x^2 + d0*x + e0 = 0
+
+    eps: float, optional
+        Roots smaller than or equal to `eps` are discarded.
+
+    Returns
+    -------
+    roots: ndarray
+        Output data is an array of size (M,) with the smallest real root
+        larger than `eps` of each polynomial, or `inf` if there is none.
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a, b, c, d = b0/a0, c0/a0, d0/a0, e0/a0
+
+        # Depressed quartic y^4 + p*y^2 + q*y + r = 0, with x = y - a/4
+        a2 = a*a
+        p = b - 0.375*a2
+        q = c - 0.5*a*b + 0.125*a2*a
+        r = d - 0.25*a*c + 0.0625*a2*b - 0.01171875*a2*a2
+
+        # Largest real root of the resolvent cubic, polished by a Newton step
+        B, C, D = p, 0.25*p*p - r, -0.125*q*q
+        m = multi_polish(multi_real_cubic_roots(B, C, D, all_roots=False), (1., B, C, D))
+        m = np.maximum(m, 0.)
+
+        # Two quadratics y^2 -/+ s*y + (p/2 + m +/- q/(2s)) = 0, with s = sqrt(2m)
+        s = np.sqrt(2.*m)
+        half = 0.5*p + m
+        t = 0.5*q/s
+        a4 = 0.25*a
+        roots = np.empty((4,) + np.shape(s))
+        for i, sign in enumerate((-1., 1.)):
+            delta = s*s - 4.*(half - sign*t)
+            # Double roots may come out slightly negative
+            sqrt_delta = np.sqrt(np.where(delta > -1e-9*(s*s + np.abs(half) + 1.), np.maximum(delta, 0.), np.nan))
+            roots[2*i] = 0.5*(-sign*s - sqrt_delta) - a4
+            roots[2*i + 1] = 0.5*(-sign*s + sqrt_delta) - a4
+
+        # Biquadratic: y^2 = (-p +/- sqrt(p^2 - 4r))/2
+        biquadratic = np.flatnonzero(s < 1e-12)
+        if biquadratic.size:
+            p, r, a4 = p[biquadratic], r[biquadratic], a4[biquadratic]
+            w = np.sqrt(np.maximum(p*p - 4.*r, 0.))
+            for i, sign in enumerate((-1., 1.)):
+                y = np.sqrt(0.5*(-p + sign*w))
+                roots[2*i, biquadratic] = -y - a4
+                roots[2*i + 1, biquadratic] = y - a4
+
+    roots[~(roots > eps)] = np.inf
+    root = multi_polish(roots.min(axis=0), (a0, b0, c0, d0, e0))
+    return np.where(root > eps, root, np.inf)
+
+
+@jit(nopython=True, parallel=True)
+def parallel_min_positive_real_root_cubic(p, eps=0.):
+    ''' Compiled, multi-threaded version of
+    `multi_min_positive_real_root_cubic` for coefficients `p` of size (M, 4).
+    '''
+    roots = np.empty(p.shape[0])
+    for i in prange(p.shape[0]):
+        roots[i] = single_min_positive_real_root_cubic(p[i, 0], p[i, 1], p[i, 2], p[i, 3], eps)
+    return roots
+
+
+@jit(nopython=True, parallel=True)
+def parallel_min_positive_real_root_quartic(p, eps=0.):
+    ''' Compiled, multi-threaded version of
+    `multi_min_positive_real_root_quartic` for coefficients `p` of size
+    (M, 5).
+    '''
+    roots = np.empty(p.shape[0])
+    for i in prange(p.shape[0]):
+        roots[i] = single_min_positive_real_root_quartic(p[i, 0], p[i, 1], p[i, 2], p[i, 3], p[i, 4], eps)
+    return roots
+
+
+def min_positive_real_root_cubic(p, eps=0., compiled=False):
+    '''
+    A caller function for the smallest real root larger than `eps` of cubic
+    equations (3rd order polynomial). Unlike `cubic_roots`, no complex
+    roots are computed.
+
+    Parameters
+    ----------
+    p: array_like
+        Input data are coefficients of the Cubic polynomial of the form:
+
+            p[0]*x^3 + p[1]*x^2 + p[2]*x + p[3] = 0
+
+        Stacked arrays of coefficient are allowed, which means that ``p`` may
+        have size ``(4,)`` or ``(M, 4)``.
+
+    eps: float, optional
+        Roots smaller than or equal to `eps` are discarded.
+
+    compiled: bool, optional
+        If set to `True`, calls `parallel_min_positive_real_root_cubic`.
+        Otherwise (default), calls `multi_min_positive_real_root_cubic`.
+
+    Returns
+    -------
+    roots: ndarray
+        Output data is an array of size ``(M,)`` with the smallest real root
+        larger than `eps` of each polynomial, or `inf` if there is none.
+
+    Examples
+    --------
+    >>> min_positive_real_root_cubic([1, 7, -806, -1050])
+    array([25.80760451])
+    '''
+    p = np.asarray(p, dtype=np.float64)
+    if p.ndim < 2:
+        p = p[np.newaxis, :]
+    if p.shape[1] != 4:
+        raise ValueError('Expected 3rd order polynomial with 4 '
+                         'coefficients, got {:d}.'.format(p.shape[1]))
+
+    if compiled:
+        return parallel_min_positive_real_root_cubic(np.ascontiguousarray(p), eps)
+    return multi_min_positive_real_root_cubic(*p.T, eps=eps)
+
+
+def min_positive_real_root_quartic(p, eps=0., compiled=False):
+    '''
+    A caller function for the smallest real root larger than `eps` of quartic
+    equations (4th order polynomial), e.g. ray intersections with implicit
+    surfaces. Unlike `quartic_roots`, no complex roots are computed.
+
+    Parameters
+    ----------
+    p: array_like
+        Input data are coefficients of the Quartic polynomial of the form:
+
+            p[0]*x^4 + p[1]*x^3 + p[2]*x^2 + p[3]*x + p[4] = 0
+
+        Stacked arrays of coefficient are allowed, which means that ``p`` may
+        have size ``(5,)`` or ``(M, 5)``.
+
+    eps: float, optional
+        Roots smaller than or equal to `eps` are discarded.
+
+    compiled: bool, optional
+        If set to `True`, calls `parallel_min_positive_real_root_quartic`.
+        Otherwise (default), calls `multi_min_positive_real_root_quartic`.
+
+    Returns
+    -------
+    roots: ndarray
+        Output data is an array of size ``(M,)`` with the smallest real root
+        larger than `eps` of each polynomial, or `inf` if there is none.
+
+    Examples
+    --------
+    >>> min_positive_real_root_quartic([1, 7, -806, -1050, 38322])
+    array([6.61999319])
+
+    >>> min_positive_real_root_quartic([[1, 2, 3, 4, 5],
+                                        [1, 7, -806, -1050, 38322]])
+    array([       inf, 6.61999319])
+    '''
+    p = np.asarray(p, dtype=np.float64)
+    if p.ndim < 2:
+        p = p[np.newaxis, :]
+    if p.shape[1] != 5:
+        raise ValueError('Expected 4th order polynomial with 5 '
+                         'coefficients, got {:d}.'.format(p.shape[1]))
+
+    if compiled:
+        return parallel_min_positive_real_root_quartic(np.ascontiguousarray(p), eps)
+    return multi_min_positive_real_root_quartic(*p.T, eps=eps)
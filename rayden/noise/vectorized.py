@@ -0,0 +1,305 @@
+# Copyright (c) 2012 Eliot Eshelman
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+###############################################################################
+
+"""NumPy versions of the 2D, 3D and 4D Simplex Noise functions.
+
+Same functions (and names) of rayden.noise.simplexnoise, but coordinates are
+arrays and one noise value is returned per point. The operations are done in
+the same order of the scalar versions, so the values are identical to them
+for double precision coordinates.
+"""
+
+import math
+import numpy as np
+from rayden.noise.simplexnoise import _grad3, _grad4, _perm, _simplex
+
+_grad3 = np.array(_grad3)
+_grad4 = np.array(_grad4)
+_perm = np.array(_perm)
+_simplex = np.array(_simplex)
+
+def octave_noise_2d(octaves, persistence, scale, x, y):
+    """2D Multi-Octave Simplex noise, for arrays of points."""
+    x, y = _coordinates(x, y)
+    total = np.zeros(x.shape)
+    frequency = scale
+    amplitude = 1.0
+    maxAmplitude = 0.0
+
+    for i in range(octaves):
+        total += raw_noise_2d(x * frequency, y * frequency) * amplitude
+        frequency *= 2.0
+        maxAmplitude += amplitude
+        amplitude *= persistence
+
+    return total / maxAmplitude
+
+def octave_noise_3d(octaves, persistence, scale, x, y, z):
+    """3D Multi-Octave Simplex noise, for arrays of points."""
+    x, y, z = _coordinates(x, y, z)
+    total = np.zeros(x.shape)
+    frequency = scale
+    amplitude = 1.0
+    maxAmplitude = 0.0
+
+    for i in range(octaves):
+        total += raw_noise_3d(x * frequency, y * frequency, z * frequency) * amplitude
+        frequency *= 2.0
+        maxAmplitude += amplitude
+        amplitude *= persistence
+
+    return total / maxAmplitude
+
+def octave_noise_4d(octaves, persistence, scale, x, y, z, w):
+    """4D Multi-Octave Simplex noise, for arrays of points."""
+    x, y, z, w = _coordinates(x, y, z, w)
+    total = np.zeros(x.shape)
+    frequency = scale
+    amplitude = 1.0
+    maxAmplitude = 0.0
+
+    for i in range(octaves):
+        total += raw_noise_4d(x * frequency, y * frequency, z * frequency, w * frequency) * amplitude
+        frequency *= 2.0
+        maxAmplitude += amplitude
+        amplitude *= persistence
+
+    return total / maxAmplitude
+
+def scaled_octave_noise_2d(octaves, persistence, scale, loBound, hiBound, x, y):
+    """2D Scaled Multi-Octave Simplex noise, between loBound and hiBound."""
+    return  (octave_noise_2d(octaves, persistence, scale, x, y) *
+            (hiBound - loBound) / 2 +
+            (hiBound + loBound) / 2)
+
+def scaled_octave_noise_3d(octaves, persistence, scale, loBound, hiBound, x, y, z):
+    """3D Scaled Multi-Octave Simplex noise, between loBound and hiBound."""
+    return  (octave_noise_3d(octaves, persistence, scale, x, y, z) *
+            (hiBound - loBound) / 2 +
+            (hiBound + loBound) / 2)
+
+def scaled_octave_noise_4d(octaves, persistence, scale, loBound, hiBound, x, y, z, w):
+    """4D Scaled Multi-Octave Simplex noise, between loBound and hiBound."""
+    return  (octave_noise_4d(octaves, persistence, scale, x, y, z, w) *
+            (hiBound - loBound) / 2 +
+            (hiBound + loBound) / 2)
+
+def scaled_raw_noise_2d(loBound, hiBound, x, y):
+    """2D Scaled Raw Simplex noise, between loBound and hiBound."""
+    return  (raw_noise_2d(x, y) *
+            (hiBound - loBound) / 2+
+            (hiBound + loBound) / 2)
+
+def scaled_raw_noise_3d(loBound, hiBound, x, y, z):
+    """3D Scaled Raw Simplex noise, between loBound and hiBound."""
+    return  (raw_noise_3d(x, y, z) *
+            (hiBound - loBound) / 2+
+            (hiBound + loBound) / 2)
+
+def scaled_raw_noise_4d(loBound, hiBound, x, y, z, w):
+    """4D Scaled Raw Simplex noise, between loBound and hiBound."""
+    return  (raw_noise_4d(x, y, z, w) *
+            (hiBound - loBound) / 2+
+            (hiBound + loBound) / 2)
+
+def raw_noise_2d(x, y):
+    """2D Raw Simplex noise, for arrays of points."""
+    x, y = _coordinates(x, y)
+
+    # Skew the input space to determine which simplex cell we're in
+    F2 = 0.5 * (math.sqrt(3.0) - 1.0)
+    s = (x + y) * F2
+    # int() truncates towards zero
+    i = _int(x + s)
+    j = _int(y + s)
+
+    G2 = (3.0 - math.sqrt(3.0)) / 6.0
+    t = (i + j).astype(np.float64) * G2
+    # The x,y distances from the cell origin
+    x0 = x - (i - t)
+    y0 = y - (j - t)
+
+    # Lower triangle, XY order: (0,0)->(1,0)->(1,1); otherwise YX order
+    i1 = (x0 > y0).astype(np.int64)
+    j1 = 1 - i1
+
+    x1 = x0 - i1 + G2
+    y1 = y0 - j1 + G2
+    x2 = x0 - 1.0 + 2.0 * G2
+    y2 = y0 - 1.0 + 2.0 * G2
+
+    # Work out the hashed gradient indices of the three simplex corners
+    ii = i & 255
+    jj = j & 255
+    gi0 = _perm[ii+_perm[jj]] % 12
+    gi1 = _perm[ii+i1+_perm[jj+j1]] % 12
+    gi2 = _perm[ii+1+_perm[jj+1]] % 12
+
+    # Contributions from the three corners
+    n0 = _corner(0.5 - x0*x0 - y0*y0, _dot(_grad3[gi0], x0, y0))
+    n1 = _corner(0.5 - x1*x1 - y1*y1, _dot(_grad3[gi1], x1, y1))
+    n2 = _corner(0.5 - x2*x2-y2*y2, _dot(_grad3[gi2], x2, y2))
+
+    return 70.0 * (n0 + n1 + n2)
+
+# Offsets (i1, j1, k1, i2, j2, k2) of the second and third corners of each 3D simplex
+_offsets3 = np.array([
+    [1,0,0,1,1,0], # X Y Z order
+    [1,0,0,1,0,1], # X Z Y order
+    [0,0,1,1,0,1], # Z X Y order
+    [0,0,1,0,1,1], # Z Y X order
+    [0,1,0,0,1,1], # Y Z X order
+    [0,1,0,1,1,0]  # Y X Z order
+])
+
+def raw_noise_3d(x, y, z):
+    """3D Raw Simplex noise, for arrays of points."""
+    x, y, z = _coordinates(x, y, z)
+
+    # Skew the input space to determine which simplex cell we're in
+    F3 = 1.0/3.0
+    s = (x+y+z) * F3
+    # int() truncates towards zero
+    i = _int(x + s)
+    j = _int(y + s)
+    k = _int(z + s)
+
+    G3 = 1.0 / 6.0
+    t = (i+j+k).astype(np.float64) * G3
+    # The x,y,z distances from the cell origin
+    x0 = x - (i - t)
+    y0 = y - (j - t)
+    z0 = z - (k - t)
+
+    # Determine which simplex we are in (same branches of the scalar version)
+    xy, yz, xz = x0 >= y0, y0 >= z0, x0 >= z0
+    simplex = np.select([xy & yz, xy & xz, xy, ~yz, ~xz], [0, 1, 2, 3, 4], 5)
+    i1, j1, k1, i2, j2, k2 = np.moveaxis(_offsets3[simplex], -1, 0)
+
+    x1 = x0 - i1 + G3
+    y1 = y0 - j1 + G3
+    z1 = z0 - k1 + G3
+    x2 = x0 - i2 + 2.0*G3
+    y2 = y0 - j2 + 2.0*G3
+    z2 = z0 - k2 + 2.0*G3
+    x3 = x0 - 1.0 + 3.0*G3
+    y3 = y0 - 1.0 + 3.0*G3
+    z3 = z0 - 1.0 + 3.0*G3
+
+    # Work out the hashed gradient indices of the four simplex corners
+    ii = i & 255
+    jj = j & 255
+    kk = k & 255
+    gi0 = _perm[ii+_perm[jj+_perm[kk]]] % 12
+    gi1 = _perm[ii+i1+_perm[jj+j1+_perm[kk+k1]]] % 12
+    gi2 = _perm[ii+i2+_perm[jj+j2+_perm[kk+k2]]] % 12
+    gi3 = _perm[ii+1+_perm[jj+1+_perm[kk+1]]] % 12
+
+    # Contributions from the four corners
+    n0 = _corner(0.6 - x0*x0 - y0*y0 - z0*z0, _dot(_grad3[gi0], x0, y0, z0))
+    n1 = _corner(0.6 - x1*x1 - y1*y1 - z1*z1, _dot(_grad3[gi1], x1, y1, z1))
+    n2 = _corner(0.6 - x2*x2 - y2*y2 - z2*z2, _dot(_grad3[gi2], x2, y2, z2))
+    n3 = _corner(0.6 - x3*x3 - y3*y3 - z3*z3, _dot(_grad3[gi3], x3, y3, z3))
+
+    return 32.0 * (n0 + n1 + n2 + n3)
+
+def raw_noise_4d(x, y, z, w):
+    """4D Raw Simplex noise, for arrays of points."""
+    x, y, z, w = _coordinates(x, y, z, w)
+
+    # Skew the (x,y,z,w) space to determine which cell of 24 simplices we're in
+    F4 = (math.sqrt(5.0)-1.0) / 4.0
+    s = (x + y + z + w) * F4
+    # int() truncates towards zero
+    i = _int(x + s)
+    j = _int(y + s)
+    k = _int(z + s)
+    l = _int(w + s)
+
+    G4 = (5.0-math.sqrt(5.0)) / 20.0
+    t = (i + j + k + l) * G4
+    # The x,y,z,w distances from the cell origin
+    x0 = x - (i - t)
+    y0 = y - (j - t)
+    z0 = z - (k - t)
+    w0 = w - (l - t)
+
+    # Magnitude ordering of x0, y0, z0 and w0, as an index of the simplex table
+    c = ((x0 > y0) * 32 + (x0 > z0) * 16 + (y0 > z0) * 8 +
+         (x0 > w0) * 4 + (y0 > w0) * 2 + (z0 > w0) * 1)
+    simplex = _simplex[c]
+
+    # Offsets of the second, third and fourth corners, from the largest coordinate
+    i1, j1, k1, l1 = np.moveaxis((simplex >= 3).astype(np.int64), -1, 0)
+    i2, j2, k2, l2 = np.moveaxis((simplex >= 2).astype(np.int64), -1, 0)
+    i3, j3, k3, l3 = np.moveaxis((simplex >= 1).astype(np.int64), -1, 0)
+
+    x1 = x0 - i1 + G4
+    y1 = y0 - j1 + G4
+    z1 = z0 - k1 + G4
+    w1 = w0 - l1 + G4
+    x2 = x0 - i2 + 2.0*G4
+    y2 = y0 - j2 + 2.0*G4
+    z2 = z0 - k2 + 2.0*G4
+    w2 = w0 - l2 + 2.0*G4
+    x3 = x0 - i3 + 3.0*G4
+    y3 = y0 - j3 + 3.0*G4
+    z3 = z0 - k3 + 3.0*G4
+    w3 = w0 - l3 + 3.0*G4
+    x4 = x0 - 1.0 + 4.0*G4
+    y4 = y0 - 1.0 + 4.0*G4
+    z4 = z0 - 1.0 + 4.0*G4
+    w4 = w0 - 1.0 + 4.0*G4
+
+    # Work out the hashed gradient indices of the five simplex corners
+    ii = i & 255
+    jj = j & 255
+    kk = k & 255
+    ll = l & 255
+    gi0 = _perm[ii+_perm[jj+_perm[kk+_perm[ll]]]] % 32
+    gi1 = _perm[ii+i1+_perm[jj+j1+_perm[kk+k1+_perm[ll+l1]]]] % 32
+    gi2 = _perm[ii+i2+_perm[jj+j2+_perm[kk+k2+_perm[ll+l2]]]] % 32
+    gi3 = _perm[ii+i3+_perm[jj+j3+_perm[kk+k3+_perm[ll+l3]]]] % 32
+    gi4 = _perm[ii+1+_perm[jj+1+_perm[kk+1+_perm[ll+1]]]] % 32
+
+    # Contributions from the five corners
+    n0 = _corner(0.6 - x0*x0 - y0*y0 - z0*z0 - w0*w0, _dot(_grad4[gi0], x0, y0, z0, w0))
+    n1 = _corner(0.6 - x1*x1 - y1*y1 - z1*z1 - w1*w1, _dot(_grad4[gi1], x1, y1, z1, w1))
+    n2 = _corner(0.6 - x2*x2 - y2*y2 - z2*z2 - w2*w2, _dot(_grad4[gi2], x2, y2, z2, w2))
+    n3 = _corner(0.6 - x3*x3 - y3*y3 - z3*z3 - w3*w3, _dot(_grad4[gi3], x3, y3, z3, w3))
+    n4 = _corner(0.6 - x4*x4 - y4*y4 - z4*z4 - w4*w4, _dot(_grad4[gi4], x4, y4, z4, w4))
+
+    return 27.0 * (n0 + n1 + n2 + n3 + n4)
+
+def _coordinates(*coordinates):
+    # Double precision arrays of the same shape
+    return np.broadcast_arrays(*(np.asarray(c, dtype=np.float64) for c in coordinates))
+
+def _int(x):
+    # Same as int(x) of each element: truncation towards zero
+    return np.trunc(x).astype(np.int64)
+
+def _corner(t, dot):
+    # Contribution t^4 * dot of a simplex corner, zero outside of its radius
+    t2 = t * t
+    return np.where(t < 0, 0.0, t2 * t2 * dot)
+
+def _dot(g, *coordinates):
+    # Dot products of gradients (N, D) and offsets, summed in the order of dot2d/dot3d/dot4d
+    total = g[..., 0] * coordinates[0]
+    for k in range(1, len(coordinates)):
+        total = total + g[..., k] * coordinates[k]
+    return total
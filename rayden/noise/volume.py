@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Douglas Uba'
+
+import hashlib
+import json
+import os
+import numpy as np
+
+class NoiseVolume():
+    # Noise field baked on a regular (nx, ny, nz) grid over the box [lower, upper],
+    # sampled with trilinear interpolation. Points outside of the box are clamped to it.
+    def __init__(self, grid, lower, upper, file=None):
+        self.grid = grid
+        self.lower = np.asarray(lower, dtype=np.float64)
+        self.upper = np.asarray(upper, dtype=np.float64)
+        self.file = file
+
+    @staticmethod
+    def bake(field, lower, upper, resolution, directory=None, key=()):
+        # Evaluates field(x, y, z) at the grid points. If a directory is given, the grid is stored there
+        # (memory-mapped .npy file) and reused by later renders with the same field, box and resolution.
+        lower, upper = np.asarray(lower, dtype=np.float64), np.asarray(upper, dtype=np.float64)
+        shape = tuple(int(n) for n in np.broadcast_to(resolution, 3))
+        if min(shape) < 2:
+            raise ValueError('Noise volume resolution must be at least 2: {}'.format(resolution))
+        file = None
+        if directory is not None:
+            description = json.dumps([list(key), lower.tolist(), upper.tolist(), shape])
+            file = os.path.join(directory, 'noise-{}.npy'.format(hashlib.sha1(description.encode()).hexdigest()[:16]))
+            if os.path.exists(file):
+                return NoiseVolume(np.load(file, mmap_mode='r'), lower, upper, file)
+            os.makedirs(directory, exist_ok=True)
+            temporary = '{}.{}.tmp'.format(file, os.getpid())
+            grid = np.lib.format.open_memmap(temporary, mode='w+', dtype=np.float32, shape=shape)
+        else:
+            grid = np.empty(shape, dtype=np.float32)
+        x, y, z = (np.linspace(lower[k], upper[k], shape[k]) for k in range(3))
+        y, z = np.meshgrid(y, z, indexing='ij')
+        # One slab at a time (bounded memory)
+        for i in range(shape[0]):
+            grid[i] = field(np.full(y.shape, x[i]), y, z)
+        if file is None:
+            return NoiseVolume(grid, lower, upper)
+        grid.flush()
+        del grid
+        os.replace(temporary, file)
+        return NoiseVolume(np.load(file, mmap_mode='r'), lower, upper, file)
+
+    def sample(self, x, y, z):
+        # Grid cell (base index) and position inside of it (weight), per axis
+        base, weight = [], []
+        for k, c in enumerate((x, y, z)):
+            n = self.grid.shape[k]
+            extent = self.upper[k] - self.lower[k]
+            u = (np.asarray(c, dtype=np.float64) - self.lower[k]) * ((n - 1) / extent if extent > 0 else 0.0)
+            u = np.clip(u, 0, n - 1)
+            i = np.minimum(u.astype(np.int64), n - 2)
+            base.append(i)
+            weight.append(u - i)
+        # Weighted sum of the eight corners of the cells
+        (i, j, k), (u, v, w) = base, weight
+        value = 0.0
+        for di, wi in ((0, 1.0 - u), (1, u)):
+            for dj, wj in ((0, 1.0 - v), (1, v)):
+                for dk, wk in ((0, 1.0 - w), (1, w)):
+                    value = value + (wi * wj * wk) * self.grid[i + di, j + dj, k + dk]
+        return value
+
+    def __getstate__(self):
+        # Memory-mapped grids are opened again from their files (e.g. in worker processes)
+        state = dict(self.__dict__)
+        if self.file is not None:
+            state['grid'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.file is not None:
+            self.grid = np.load(self.file, mmap_mode='r')
@@ -4,10 +4,21 @@ __author__ = 'Douglas Uba'
 
 from abc import ABC, abstractmethod
 import numpy as np
+from rayden.bvh import BVH
 from rayden.constants import MAX_DISTANCE, EPSILON
+from rayden import floats, kernels
 from rayden.math import fqs
 from rayden.vector import Vec3
 
+# Member list of single primitives (compiled kernels)
+SINGLE = np.zeros(1, dtype=np.int64)
+
+def compiledIntercept(kernel, ray, *args):
+    origin, direction = ray.arrays()
+    nearest, ids = kernels.buffers(direction.shape[0])
+    kernel(origin, direction, *args, nearest, ids, floats.epsilon())
+    return nearest
+
 class Primitive(ABC):
     def __init__(self):
         self.material = None
@@ -17,9 +28,25 @@ class Primitive(ABC):
         pass
 
     @abstractmethod
-    def getNormalAt(self, p):
+    def getNormalAt(self, p, member=None):
         pass
 
+    def interceptMember(self, ray):
+        # Distances and the member (e.g. triangle of a mesh) that was hit. None for single primitives.
+        return self.intercept(ray), None
+
+    def getBounds(self):
+        # Axis-aligned bounding box (lower, upper). None for unbounded primitives.
+        return None
+
+    def occluded(self, ray, maxDistance):
+        # Any-hit query (e.g. shadow rays): is there a hit closer than maxDistance?
+        return self.intercept(ray) < maxDistance
+
+    def getMaterialGroups(self, member):
+        # Hits (members) that share a material: [(material, selection or None for all)]
+        return [(self.material, None)]
+
     def setMaterial(self, material):
         self.material = material
 
@@ -32,6 +59,9 @@ class Sphere(Primitive):
         self.radius = radius
 
     def intercept(self, ray):
+        if kernels.isCompiled():
+            return compiledIntercept(kernels.intersectSpheres, ray, self.center.data[np.newaxis],
+                                     np.array([self.radius], dtype=floats.dtype()), SINGLE)
         b = 2 * ray.direction.dot(ray.origin - self.center)
         c = abs(self.center) + abs(ray.origin) - 2 * self.center.dot(ray.origin) - (self.radius * self.radius)
         disc = (b ** 2) - (4 * c)
@@ -39,24 +69,31 @@ class Sphere(Primitive):
         h0 = (-b - sq) * 0.5
         h1 = (-b + sq) * 0.5
         h = np.where((h0 > 0) & (h0 < h1), h0, h1)
-        pred = (disc >= 0) & (h > EPSILON)
+        pred = (disc >= 0) & (h > floats.epsilon())
         return np.where(pred, h, MAX_DISTANCE)
 
-    def getNormalAt(self, p):
+    def getNormalAt(self, p, member=None):
         return (p - self.center).normalized()
 
+    def getBounds(self):
+        r = Vec3(self.radius, self.radius, self.radius)
+        return self.center - r, self.center + r
+
 class Plane(Primitive):
     def __init__(self, normal, distance):
         self.normal = normal.normalized()
         self.distance = distance
 
     def intercept(self, ray):
+        if kernels.isCompiled():
+            return compiledIntercept(kernels.intersectPlanes, ray, self.normal.data[np.newaxis],
+                                     np.array([self.distance], dtype=floats.dtype()), SINGLE)
         c = ray.direction.dot(self.normal) # case == 0?
         t = -1.0 * ((self.normal.dot(ray.origin) + self.distance) / c)
-        pred = (t >= EPSILON) & (np.abs(c) > EPSILON)
+        pred = (t >= floats.epsilon()) & (np.abs(c) > EPSILON)
         return np.where(pred, t, MAX_DISTANCE)
 
-    def getNormalAt(self, p):
+    def getNormalAt(self, p, member=None):
         return self.normal
 
 class Triangle(Primitive):
@@ -68,7 +105,14 @@ class Triangle(Primitive):
         self.edge2 = c - a
         self.normal = (self.c - self.a).cross(self.b - self.a).normalized()
 
+    def getBounds(self):
+        vertices = [self.a.components(), self.b.components(), self.c.components()]
+        return Vec3(*np.min(vertices, axis=0)), Vec3(*np.max(vertices, axis=0))
+
     def intercept(self, ray):
+        if kernels.isCompiled():
+            return compiledIntercept(kernels.intersectTriangles, ray, self.a.data[np.newaxis],
+                                     self.edge1.data[np.newaxis], self.edge2.data[np.newaxis], SINGLE)
         h = ray.direction.cross(self.edge2)
         delta = self.edge1.dot(h)
         pred_delta = (delta <= -EPSILON) | (delta >= EPSILON)
@@ -80,11 +124,11 @@ class Triangle(Primitive):
         v = f * ray.direction.dot(q)
         pred_v = (v >= 0.0) & (u + v <= 1.0)
         t = f * self.edge2.dot(q)
-        pred_t = (t > EPSILON)
+        pred_t = (t > floats.epsilon())
         pred = (pred_delta) & (pred_u) & (pred_v) & (pred_t)
         return np.where(pred, t, MAX_DISTANCE)
 
-    def getNormalAt(self, p):
+    def getNormalAt(self, p, member=None):
         return self.normal
 
 class Torus(Primitive):
@@ -92,33 +136,259 @@ class Torus(Primitive):
         self.sweptRadius = sweptRadius
         self.tubeRadius = tubeRadius
 
+    def getBounds(self):
+        # Centered at the origin, around the y-axis
+        r = self.sweptRadius + self.tubeRadius
+        return Vec3(-r, -self.tubeRadius, -r), Vec3(r, self.tubeRadius, r)
+
     def intercept(self, ray):
-        ox, oy, oz = ray.origin.x, ray.origin.y, ray.origin.z
-        dx, dy, dz = ray.direction.x, ray.direction.y, ray.direction.z
+        if kernels.isCompiled():
+            return compiledIntercept(kernels.intersectTorus, ray, float(self.sweptRadius), float(self.tubeRadius))
+        # Double precision (quartic)
+        origin, direction = (a.astype(np.float64, copy=False) for a in ray.arrays())
+        t = np.full(direction.shape[0], MAX_DISTANCE)
+
+        # Bounding sphere rejection (radius sweptRadius + tubeRadius, at the origin)
+        radius = self.sweptRadius + self.tubeRadius
+        b = np.sum(origin * direction, axis=1)
+        disc = b * b - (np.sum(origin * origin, axis=1) - radius * radius)
+        sq = np.sqrt(np.maximum(disc, 0.0))
+        candidates = np.flatnonzero((disc >= 0.0) & (-b + sq > floats.epsilon()))
+        if not candidates.shape[0]:
+            return t
+
+        # Start the rays at the bounding sphere (better conditioned quartic)
+        start = np.maximum(-b[candidates] - sq[candidates], 0.0)
+        o = origin[candidates] + direction[candidates] * start[:, np.newaxis]
+        ox, oy, oz = o[:, 0], o[:, 1], o[:, 2]
+        dx, dy, dz = direction[candidates, 0], direction[candidates, 1], direction[candidates, 2]
         sum_d_sqrd = dx * dx + dy * dy + dz * dz
         e = ox * ox + oy * oy + oz * oz - self.sweptRadius * self.sweptRadius - self.tubeRadius * self.tubeRadius
         f = ox * dx + oy * dy + oz * dz
         four_a_sqrd	= 4.0 * self.sweptRadius * self.sweptRadius
-        coeffs = [
-            e * e - four_a_sqrd * (self.tubeRadius * self.tubeRadius - oy * oy), #c0
-            4.0 * f * e + 2.0 * four_a_sqrd * oy * dy, #c1
-            2.0 * sum_d_sqrd * e + 4.0 * f * f + four_a_sqrd * dy * dy, #c2
+        root = fqs.multi_min_positive_real_root_quartic(
+            sum_d_sqrd * sum_d_sqrd, #c4
             4.0 * sum_d_sqrd * f, # c3
-            sum_d_sqrd * sum_d_sqrd #c4
-        ]
-        c = np.empty((coeffs[1].shape[0], 5), dtype=np.float64)
-        c[:,0], c[:,1], c[:,2], c[:,3], c[:,4] = coeffs[4], coeffs[3], coeffs[2], coeffs[1], coeffs[0]
-        roots = fqs.quartic_roots(c)
-        roots[np.iscomplex(roots)] = MAX_DISTANCE
-        t = np.min(np.real(roots), axis=1)
-        t = t.astype(np.float64)
-        t[t <= EPSILON] = MAX_DISTANCE
-        return t
-
-    def getNormalAt(self, p):
+            2.0 * sum_d_sqrd * e + 4.0 * f * f + four_a_sqrd * dy * dy, #c2
+            4.0 * f * e + 2.0 * four_a_sqrd * oy * dy, #c1
+            e * e - four_a_sqrd * (self.tubeRadius * self.tubeRadius - oy * oy), #c0
+            floats.epsilon()
+        )
+        hit = np.isfinite(root)
+        t[candidates[hit]] = root[hit] + start[hit]
+        t[t <= floats.epsilon()] = MAX_DISTANCE
+        return t.astype(floats.dtype(), copy=False)
+
+    def getNormalAt(self, p, member=None):
         pSquared = self.sweptRadius * self.sweptRadius + self.tubeRadius * self.tubeRadius
         sumSquared = p.x * p.x + p.y * p.y + p.z * p.z
         normal = Vec3(4.0 * p.x * (sumSquared - pSquared),
                       4.0 * p.y * (sumSquared - pSquared + 2.0 * self.sweptRadius * self.sweptRadius),
                       4.0 * p.z * (sumSquared - pSquared))
-        return normal.normalized()
\ No newline at end of file
+        return normal.normalized()
+
+class PrimitiveSet(Primitive):
+    # Structure-of-arrays group of members, intersected in bulk (through a BVH over the members, if any)
+    BLOCK_SIZE = 1 << 18
+
+    def __init__(self):
+        self.material = None
+        self.materials = None
+        self.materialIds = None
+        self.bvh = None
+
+    @abstractmethod
+    def size(self):
+        pass
+
+    @abstractmethod
+    def intersectMembers(self, origin, direction, members):
+        # Distances of (rays, members), as a 2D array
+        pass
+
+    @abstractmethod
+    def intersectCompiled(self, origin, direction, members, nearest, ids):
+        # Compiled kernel: updates nearest and ids in place
+        pass
+
+    def __nearest(self, origin, direction, members):
+        if kernels.isCompiled():
+            nearest, ids = kernels.buffers(direction.shape[0])
+            self.intersectCompiled(origin, direction, members, nearest, ids)
+            return nearest, ids
+        # Nearest member per ray, in blocks of members (bounded memory)
+        step = max(1, self.BLOCK_SIZE // max(1, direction.shape[0]))
+        nearest = floats.distances(direction.shape[0])
+        ids = np.full(direction.shape[0], -1)
+        for i in range(0, members.shape[0], step):
+            block = members[i:i + step]
+            t = self.intersectMembers(origin, direction, block)
+            index = np.argmin(t, axis=1)
+            t = t[np.arange(t.shape[0]), index]
+            closer = t < nearest
+            nearest[closer] = t[closer]
+            ids[closer] = block[index[closer]]
+        return nearest, ids
+
+    def intercept(self, ray):
+        return self.interceptMember(ray)[0]
+
+    def interceptMember(self, ray):
+        origin, direction = ray.arrays()
+        if self.bvh is None:
+            return self.__nearest(origin, direction, np.arange(self.size()))
+        leaf = lambda members, rays: self.__nearest(origin[rays], direction[rays], members) + (None,)
+        nearest, members, _ = self.bvh.intersect(origin, direction, leaf)
+        return nearest, members
+
+    def occluded(self, ray, maxDistance):
+        origin, direction = ray.arrays()
+        maxDistance = np.broadcast_to(maxDistance, (direction.shape[0],))
+        if self.bvh is None:
+            return self.__nearest(origin, direction, np.arange(self.size()))[0] < maxDistance
+        leaf = lambda members, rays, distance: self.__nearest(origin[rays], direction[rays], members)[0] < distance
+        return self.bvh.occluded(origin, direction, maxDistance, leaf)
+
+    def setMaterials(self, materials, materialIds):
+        # One material index per member
+        self.materials = materials
+        self.materialIds = np.asarray(materialIds, dtype=np.int64)
+        self.material = materials[0]
+
+    def getMaterialGroups(self, member):
+        if self.materialIds is None:
+            return [(self.material, None)]
+        ids = self.materialIds[member]
+        return [(self.materials[k], ids == k) for k in np.unique(ids)]
+
+class SphereSet(PrimitiveSet):
+    def __init__(self, centers, radii, leafSize=8):
+        super().__init__()
+        self.centers = np.ascontiguousarray(centers, dtype=floats.dtype())
+        self.radii = np.ascontiguousarray(radii, dtype=floats.dtype())
+        r = self.radii[:, np.newaxis]
+        self.bvh = BVH(self.centers - r, self.centers + r, leafSize)
+
+    @staticmethod
+    def fromSpheres(spheres):
+        return SphereSet([s.center.components() for s in spheres], [s.radius for s in spheres])
+
+    def size(self):
+        return self.radii.shape[0]
+
+    def intersectCompiled(self, origin, direction, members, nearest, ids):
+        kernels.intersectSpheres(origin, direction, self.centers, self.radii, members, nearest, ids, floats.epsilon())
+
+    def intersectMembers(self, origin, direction, members):
+        oc = origin[:, np.newaxis] - self.centers[members]
+        b = 2 * np.sum(direction[:, np.newaxis] * oc, axis=2)
+        c = np.sum(oc * oc, axis=2) - self.radii[members] * self.radii[members]
+        disc = (b ** 2) - (4 * c)
+        sq = np.sqrt(np.maximum(0, disc))
+        h0 = (-b - sq) * 0.5
+        h1 = (-b + sq) * 0.5
+        h = np.where((h0 > 0) & (h0 < h1), h0, h1)
+        pred = (disc >= 0) & (h > floats.epsilon())
+        return np.where(pred, h, MAX_DISTANCE)
+
+    def getNormalAt(self, p, member=None):
+        c = self.centers[member]
+        return (p - Vec3.fromArray(c)).normalized()
+
+    def getBounds(self):
+        r = self.radii[:, np.newaxis]
+        return Vec3(*(self.centers - r).min(axis=0)), Vec3(*(self.centers + r).max(axis=0))
+
+class PlaneSet(PrimitiveSet):
+    def __init__(self, normals, distances):
+        super().__init__()
+        normals = np.asarray(normals, dtype=floats.dtype())
+        self.normals = normals / np.linalg.norm(normals, axis=1)[:, np.newaxis]
+        self.distances = np.ascontiguousarray(distances, dtype=floats.dtype())
+
+    @staticmethod
+    def fromPlanes(planes):
+        return PlaneSet([p.normal.components() for p in planes], [p.distance for p in planes])
+
+    def size(self):
+        return self.distances.shape[0]
+
+    def intersectCompiled(self, origin, direction, members, nearest, ids):
+        kernels.intersectPlanes(origin, direction, self.normals, self.distances, members, nearest, ids, floats.epsilon())
+
+    def intersectMembers(self, origin, direction, members):
+        n = self.normals[members]
+        c = direction @ n.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = -1.0 * ((origin @ n.T + self.distances[members]) / c)
+        pred = (t >= floats.epsilon()) & (np.abs(c) > EPSILON)
+        return np.where(pred, t, MAX_DISTANCE)
+
+    def getNormalAt(self, p, member=None):
+        n = self.normals[member]
+        return Vec3.fromArray(n)
+
+class TriangleMesh(PrimitiveSet):
+    def __init__(self, vertices, faces, smooth=False, leafSize=8):
+        super().__init__()
+        # Contiguous arrays: vertices (V, 3) and triangles as vertex indices (F, 3)
+        self.vertices = np.ascontiguousarray(vertices, dtype=floats.dtype())
+        self.faces = np.ascontiguousarray(faces, dtype=np.int64)
+        a, b, c = (self.vertices[self.faces[:, k]] for k in range(3))
+        self.a = a
+        self.edge1 = b - a
+        self.edge2 = c - a
+        # Same orientation of Triangle normals
+        normals = np.cross(self.edge2, self.edge1)
+        self.normals = normals / np.maximum(np.linalg.norm(normals, axis=1), EPSILON)[:, np.newaxis]
+        self.vertexNormals = None
+        if smooth:
+            # Area-weighted per-vertex normals
+            self.vertexNormals = np.zeros(self.vertices.shape, dtype=self.vertices.dtype)
+            for k in range(3):
+                np.add.at(self.vertexNormals, self.faces[:, k], normals)
+            self.vertexNormals /= np.maximum(np.linalg.norm(self.vertexNormals, axis=1), EPSILON)[:, np.newaxis]
+        self.bvh = BVH(np.minimum(np.minimum(a, b), c), np.maximum(np.maximum(a, b), c), leafSize)
+
+    def size(self):
+        return self.faces.shape[0]
+
+    def intersectCompiled(self, origin, direction, members, nearest, ids):
+        kernels.intersectTriangles(origin, direction, self.a, self.edge1, self.edge2, members, nearest, ids, floats.epsilon())
+
+    def intersectMembers(self, origin, direction, triangles):
+        # Moller-Trumbore, broadcasted over (rays, triangles)
+        d = direction[:, np.newaxis]
+        e1, e2 = self.edge1[triangles], self.edge2[triangles]
+        h = np.cross(d, e2)
+        delta = np.sum(e1 * h, axis=2)
+        pred_delta = (delta <= -EPSILON) | (delta >= EPSILON)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f = 1.0/delta
+            s = origin[:, np.newaxis] - self.a[triangles]
+            u = f * np.sum(s * h, axis=2)
+            q = np.cross(s, e1)
+            v = f * np.sum(d * q, axis=2)
+            t = f * np.sum(e2 * q, axis=2)
+            pred = pred_delta & (u >= 0.0) & (u <= 1.0) & (v >= 0.0) & (u + v <= 1.0) & (t > floats.epsilon())
+        return np.where(pred, t, MAX_DISTANCE)
+
+    def getNormalAt(self, p, member=None):
+        if self.vertexNormals is None:
+            n = self.normals[member]
+            return Vec3.fromArray(n)
+        # Interpolate vertex normals with the barycentric coordinates of p
+        e1, e2 = self.edge1[member], self.edge2[member]
+        w = p.data - self.a[member]
+        d00, d01, d11 = np.sum(e1 * e1, axis=1), np.sum(e1 * e2, axis=1), np.sum(e2 * e2, axis=1)
+        d20, d21 = np.sum(w * e1, axis=1), np.sum(w * e2, axis=1)
+        denominator = d00 * d11 - d01 * d01
+        v = (d11 * d20 - d01 * d21) / denominator
+        w = (d00 * d21 - d01 * d20) / denominator
+        faces = self.faces[member]
+        n = (1.0 - v - w)[:, np.newaxis] * self.vertexNormals[faces[:, 0]] + \
+            v[:, np.newaxis] * self.vertexNormals[faces[:, 1]] + w[:, np.newaxis] * self.vertexNormals[faces[:, 2]]
+        return Vec3.fromArray(n).normalized()
+
+    def getBounds(self):
+        return Vec3(*self.vertices.min(axis=0)), Vec3(*self.vertices.max(axis=0))
@@ -2,6 +2,7 @@
 
 __author__ = 'Douglas Uba'
 
+import numpy as np
 from rayden.vector import Vec3
 from rayden.utils import extract
 
@@ -13,6 +14,7 @@ class Ray():
         self.filter = None
 
     def setDistance(self, distance, filter=None):
+        # Distances of all rays. filter (boolean mask or index array) selects the rays being shaded.
         self.distance = distance
         self.filter = filter
 
@@ -24,4 +26,25 @@ class Ray():
 
     def inverted(self):
         return self.getDirection().inverted()
-        
+
+    def size(self):
+        return self.direction.data.shape[0] if self.direction.data.ndim == 2 else 1
+
+    def arrays(self):
+        # Origins and directions as (N, 3) arrays
+        size = self.size()
+        return tuple(np.ascontiguousarray(np.broadcast_to(v.data, (size, 3))) for v in (self.origin, self.direction))
+
+    def extract(self, cond):
+        return Ray(self.origin.extract(cond), self.direction.extract(cond))
+
+    def take(self, index):
+        return Ray(self.origin.take(index), self.direction.take(index))
+
+    @staticmethod
+    def concatenate(rays):
+        # Join a list of rays into a single batch (single origins are broadcasted)
+        sizes = [r.size() for r in rays]
+        def join(vectors):
+            return Vec3.fromArray(np.concatenate([np.broadcast_to(v.data, (n, 3)) for v, n in zip(vectors, sizes)]))
+        return Ray(join([r.origin for r in rays]), join([r.direction for r in rays]))
@@ -3,16 +3,44 @@
 __author__ = 'Douglas Uba'
 
 from abc import ABC, abstractmethod
-from functools import reduce
 import multiprocessing
+from multiprocessing import resource_tracker
 import numpy as np
-from PIL import Image
+from rayden import floats, kernels, sampler
 from rayden.color import RGB
-from rayden.constants import EPSILON, MAX_DISTANCE, AIR_REFRACTION_INDEX
+from rayden.constants import EPSILON, AIR_REFRACTION_INDEX
+from rayden.framebuffer import FrameBuffer
 from rayden.ray import Ray
-from rayden.utils import extract
+from rayden.utils import ScratchPool, extract
 from rayden.vector import Vec3
 
+# Tracer and attached frame buffer owned by each worker process
+_tracer = None
+_framebuffer = None
+
+def _initWorker(tracer):
+    global _tracer
+    _tracer = tracer
+    kernels.setBackend(tracer.backend)
+    # Workers already run in parallel: their kernels share the remaining CPUs (one thread, by default)
+    if kernels.isCompiled():
+        kernels.setThreads(max(1, multiprocessing.cpu_count() // tracer.processes))
+    floats.setPrecision(tracer.precision)
+
+def _renderTile(task):
+    global _framebuffer
+    name, frame, tile = task
+    if _framebuffer is None or _framebuffer.getName() != name:
+        if _framebuffer is not None:
+            _framebuffer.close()
+        _framebuffer = FrameBuffer(_tracer.camera.width, _tracer.camera.height, name, floats.dtype())
+    _tracer.renderTile(tile, _framebuffer, frame)
+    # Traversal statistics of this tile
+    accelerator = _tracer.scene.getAccelerator()
+    counters = accelerator.counters
+    accelerator.resetCounters()
+    return counters
+
 class Renderer(ABC):
     def __init__(self, scene, refractionIndex=AIR_REFRACTION_INDEX):
         self.camera = scene.getCamera()
@@ -30,52 +58,170 @@ class RayTracer(Renderer):
                  samplesPerShadow=5,
                  depthComplexity=1,
                  dispersion=5.0,
-                 Phong=False): # Blinn-Phong, otherwise
+                 Phong=False, # Blinn-Phong, otherwise
+                 tileSize=32,
+                 processes=None,
+                 adaptive=False, # samplesPerPixel is the maximum, in this case
+                 adaptiveThreshold=0.01,
+                 minSamplesPerPixel=4,
+                 maxDepth=8,
+                 minThroughput=0.001,
+                 russianRoulette=False,
+                 rouletteDepth=3,
+                 backend=kernels.NUMPY,
+                 precision=None, # current precision (floats.setPrecision), by default
+                 sampler=None, # rayden.sampler.Sampler. Independent random samples (seeded generators), otherwise.
+                 seed=None): # Random samples are reproducible for a given seed (fresh entropy, by default)
         super().__init__(scene, refractionIndex)
         self.samplesPerPixel = samplesPerPixel
         self.samplesPerShadow = samplesPerShadow
         self.depthComplexity = depthComplexity
         self.dispersion = dispersion
         self.Phong = Phong
-        self.maxProcessNumber = multiprocessing.cpu_count() * 4
+        self.tileSize = tileSize
+        self.processes = processes or multiprocessing.cpu_count()
+        self.adaptive = adaptive
+        self.adaptiveThreshold = adaptiveThreshold
+        self.minSamplesPerPixel = minSamplesPerPixel
+        self.maxDepth = maxDepth
+        self.minThroughput = minThroughput
+        self.russianRoulette = russianRoulette
+        self.rouletteDepth = rouletteDepth
+        # Pixel, lens and light samples
+        self.sampler = sampler
+        # Random streams: one generator per (frame, tile, pixel sample), derived from the seed.
+        # Images do not depend on the number of processes nor on the order in which tiles are rendered.
+        self.seed = seed
+        self.entropy = np.random.SeedSequence(seed).entropy
+        self.frame = 0
+        self.rng = np.random.default_rng(np.random.SeedSequence(self.entropy))
+        # Intersection kernels: NumPy or compiled (numba)
+        self.backend = backend
+        kernels.setBackend(backend)
+        # Floating-point precision. Scenes are built in the precision that is set when they are read.
+        self.precision = precision or floats.getPrecision()
+        floats.setPrecision(self.precision)
+        self.pool = None
+        self.counters = {}
+        # Temporary buffers of the shading loop, reused across evaluations and bounces
+        self.scratch = ScratchPool()
+
+    def __getstate__(self):
+        # The worker pool is never shipped to the workers
+        state = self.__dict__.copy()
+        state['pool'] = None
+        return state
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self):
+        # Fork workers once for the whole session (i.e. many renders of the same scene)
+        if self.pool is None:
+            self.pool = self.__createPool()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __createPool(self):
+        # Workers share the parent resource tracker, which owns the frame buffers
+        resource_tracker.ensure_running()
+        return multiprocessing.Pool(self.processes, initializer=_initWorker, initargs=(self,))
 
     def render(self):
-        manager = multiprocessing.Manager()
-        results = manager.dict()
-        jobs = []
-        # Start processes
-        for i in range(self.samplesPerPixel):
-            rays = self.camera.getRays(sampling=True)
-            p = multiprocessing.Process(target=self.depthAndTrace, args=(i, rays, results))
-            jobs.append(p)
-            p.start()
-            if(len(jobs) >= self.maxProcessNumber):
-              # Wait...
-              for proc in jobs:
-                  proc.join()
-              jobs = []
-        # Wait...
-        for proc in jobs:
-            proc.join()
-
-        # Composition-stack
-        color = RGB(0,0,0)
-        for key in results:
-            color += results[key]
-        color = color * (1/float(self.samplesPerPixel))
-
-        rgb = [Image.fromarray((255 * np.clip(c, 0, 1).reshape((self.camera.height, self.camera.width))).astype(np.uint8), 'L') for c in color.components()]
-        return Image.merge('RGB', rgb)
-
-    def depthAndTrace(self, i, rays, results):
-        if self.depthComplexity == 1:
-            results[i] = self.__trace(rays)
+        # Accumulation buffer shared by all workers (tiles are disjoint, no locks needed)
+        framebuffer = FrameBuffer(self.camera.width, self.camera.height, dtype=floats.dtype())
+        tasks = [(framebuffer.getName(), self.frame, tile) for tile in self.camera.getTiles(self.tileSize)]
+        # Each render of the session is a new frame (new random streams)
+        self.frame += 1
+
+        # Workers pull tiles from a shared queue as soon as they are idle (one tile per task)
+        pool = self.pool if self.pool is not None else self.__createPool()
+        try:
+            self.counters = {}
+            for counters in pool.imap_unordered(_renderTile, tasks):
+                for key, value in counters.items():
+                    self.counters[key] = self.counters.get(key, 0) + value
+            return framebuffer.toImage()
+        finally:
+            if pool is not self.pool:
+                pool.close()
+                pool.join()
+            framebuffer.close()
+            framebuffer.unlink()
+
+    def renderTile(self, tile, framebuffer, frame=0):
+        pixels = self.camera.getTilePixels(tile)
+        # All samples of the tile are computed locally
+        if self.adaptive:
+            self.__renderAdaptive(tile, pixels, framebuffer, frame)
             return
+        for i in range(self.samplesPerPixel):
+            self.rng = self.__generator(frame, tile, i)
+            rays = self.__primaryRays(pixels, i)
+            framebuffer.accumulate(tile, self.depthAndTrace(rays, pixels, i))
+
+    def __generator(self, frame, tile, sampleIndex):
+        # Independent stream of the random samples of a tile, keyed by its first pixel
+        key = (frame, tile[0], tile[1], sampleIndex)
+        return np.random.default_rng(np.random.SeedSequence(self.entropy, spawn_key=key))
+
+    def __primaryRays(self, pixels, sampleIndex):
+        # Jittered rays through the pixels (and the lens), from the sampler or random
+        if self.sampler is None:
+            return self.camera.getRays(sampling=True, pixels=pixels, rng=self.rng)
+        return self.camera.getRays(sampling=True, pixels=pixels,
+                                   jitter=self.sampler.get2D(pixels, sampleIndex, sampler.PIXEL),
+                                   lens=self.sampler.get2D(pixels, sampleIndex, sampler.LENS))
+
+    def __renderAdaptive(self, tile, pixels, framebuffer, frame):
+        # Running mean and variance (Welford) of the luminance, per pixel
+        n = np.zeros(pixels.shape)
+        mean = np.zeros(pixels.shape)
+        m2 = np.zeros(pixels.shape)
+        active = np.arange(pixels.shape[0])
+        for i in range(self.samplesPerPixel):
+            if i >= max(self.minSamplesPerPixel, 2):
+                # Keep pixels whose 95% confidence interval is still above the threshold
+                interval = 1.96 * np.sqrt(m2[active] / ((n[active] - 1) * n[active]))
+                active = active[interval > self.adaptiveThreshold]
+                if active.shape[0] == 0:
+                    break
+            # Trace the still active pixels only
+            self.rng = self.__generator(frame, tile, i)
+            rays = self.__primaryRays(pixels[active], i)
+            color = self.depthAndTrace(rays, pixels[active], i)
+            framebuffer.accumulate(tile, color, active)
+            y = np.broadcast_to(color.luminance(), active.shape)
+            n[active] += 1
+            delta = y - mean[active]
+            mean[active] += delta / n[active]
+            m2[active] += delta * (y - mean[active])
+
+    def depthAndTrace(self, rays, pixels=None, sampleIndex=0):
+        # pixels: image pixel of each ray (all of them, by default). sampleIndex: pixel sample being traced.
+        pixels = np.arange(rays.size()) if pixels is None else pixels
+        # A thin lens camera samples the depth of field with the primary rays
+        if self.depthComplexity == 1 or self.camera.hasLens():
+            return self.__trace(rays, pixels, sampleIndex)
         # else
+        x, y = self.camera.getScreen(pixels)
         color = RGB(0,0,0)
         for j in range(self.depthComplexity):
-            rx = np.random.random()/100.0
-            ry = np.random.random()/100.0
+            if self.sampler is None:
+                rx, ry = self.rng.random(), self.rng.random()
+            else:
+                # One lens position per pass, stratified over the passes of all pixel samples
+                index = sampleIndex * self.depthComplexity + j
+                rx, ry = (float(v) for v in self.sampler.get2D(0, index, sampler.LENS, self.samplesPerPixel * self.depthComplexity))
+            rx, ry = rx/100.0, ry/100.0
             displacement = Vec3(self.dispersion * rx, self.dispersion * ry, 0.0)
             # Rebuild rays
             neweye = self.camera.eye + displacement
@@ -83,31 +229,95 @@ class RayTracer(Renderer):
             u = self.camera.up.cross(w).normalized()
             v = w.cross(u)
             rays.origin = neweye
-            rays.direction = ((u * self.camera.x) + (v * self.camera.y) + w).normalized()
-            color += self.__trace(rays)
-        results[i] = color * (1/float(self.depthComplexity))
-
-    def __trace(self, rays):
-        distances = [p.intercept(rays) for p in self.scene.primitives]
-        nearest = reduce(np.minimum, distances)
-        color = RGB(0, 0, 0)
-        for (p, d) in zip(self.scene.primitives, distances):
-            hit = (nearest != MAX_DISTANCE) & (d == nearest)
-            if np.any(hit):
-                rays.setDistance(d, hit)
-                color += self.__evaluate(p, rays).place(hit)
+            rays.direction = ((u * x) + (v * y) + w).normalized()
+            color += self.__trace(rays, pixels, sampleIndex)
+        return color * (1/float(self.depthComplexity))
+
+    def __trace(self, rays, imagePixels, sampleIndex):
+        size = rays.size()
+        color = RGB(np.zeros(size), np.zeros(size), np.zeros(size))
+        # Wavefront: rays of the current bounce, the primary ray (pixel) of each one and its throughput
+        pixels = np.arange(size)
+        throughput = np.ones(size, dtype=floats.dtype())
+        for depth in range(self.maxDepth + 1):
+            nearest, ids, members = self.scene.getAccelerator().intersect(rays)
+            # Shaded color of each ray of the wavefront (misses stay black)
+            bounceColor = np.zeros((pixels.shape[0], 3), dtype=floats.dtype())
+            secondary = []
+            for (i, hit) in self.__groupHits(ids):
+                p = self.scene.primitives[i]
+                # Primitive sets may have a material per member
+                for (material, selection) in p.getMaterialGroups(members[hit]):
+                    shade = hit if selection is None else hit[selection]
+                    rays.setDistance(nearest, shade)
+                    pixelSamples = (imagePixels[pixels[shade]], sampleIndex, depth)
+                    local, spawned = self.__evaluate(p, material, rays, members[shade], pixelSamples, depth < self.maxDepth)
+                    bounceColor[shade] = local.data
+                    for (ray, weight) in spawned:
+                        secondary.append((ray, pixels[shade], throughput[shade] * weight))
+            # Composition (many rays of the wavefront may belong to the same pixel)
+            for k, c in enumerate(color.components()):
+                c += np.bincount(pixels, bounceColor[:, k] * throughput, minlength=size)
+            if not secondary:
+                break
+            # Next wavefront as a single batch
+            rays = Ray.concatenate([r for (r, _, _) in secondary])
+            pixels = np.concatenate([i for (_, i, _) in secondary])
+            throughput = np.concatenate([w for (_, _, w) in secondary])
+            rays, pixels, throughput = self.__terminate(rays, pixels, throughput, depth)
+            if pixels.shape[0] == 0:
+                break
         return color
 
-    def __evaluate(self, primitive, rays):
+    @staticmethod
+    def __groupHits(ids):
+        # (primitive, indices of the rays that hit it), from a single sort of the hit ids (misses are -1)
+        order = np.argsort(ids, kind='stable')
+        sortedIds = ids[order]
+        bounds = np.flatnonzero(np.diff(sortedIds)) + 1
+        first = np.searchsorted(sortedIds, 0)
+        return [(sortedIds[start], index) for start, index in zip(np.r_[0, bounds], np.split(order, bounds))
+                if start >= first]
+
+    def __terminate(self, rays, pixels, throughput, depth):
+        alive = throughput > self.minThroughput
+        if self.russianRoulette and depth + 1 >= self.rouletteDepth:
+            # Survivors are reweighted, so the estimate is still unbiased
+            probability = np.minimum(throughput, 1.0)
+            alive &= self.rng.random(throughput.shape) < probability
+            throughput = throughput / np.where(alive, probability, 1.0)
+        if np.all(alive):
+            return rays, pixels, throughput
+        return rays.extract(alive), pixels[alive], throughput[alive]
+
+    def __scratchVec3(self, size):
+        return Vec3.fromArray(self.scratch.get((size, 3)))
+
+    def __lightSamples(self, pixelSamples, light):
+        # Sampler values of the shadow samples (sample-major): the shadow samples of all pixel samples
+        # form the sequence of each pixel, two dimensions per light and bounce
+        if self.sampler is None:
+            return None
+        pixels, sampleIndex, depth = pixelSamples
+        n = self.samplesPerShadow
+        index = np.repeat(sampleIndex * n + np.arange(n), pixels.shape[0])
+        dimension = sampler.LIGHT + 2 * (depth * len(self.scene.lights) + light)
+        return self.sampler.get2D(np.tile(pixels, n), index, dimension, self.samplesPerPixel * n)
+
+    def __evaluate(self, primitive, material, rays, member, pixelSamples, bounce=True):
+        # pixelSamples: (image pixels, pixel sample index, bounce) of the rays
+        # Temporaries of the previous evaluation are no longer in use
+        self.scratch.reset()
+
         # Get intersection info
         hitPoint = rays.findDestination()
 
         # Get normal at intersection point
-        normal = primitive.getNormalAt(hitPoint)
+        normal = primitive.getNormalAt(hitPoint, member)
 
         # Modify normal by material, if necessary
-        if primitive.material.normalMap is not None:
-            normal = primitive.material.normalMap.modify(normal, hitPoint)
+        if material.normalMap is not None:
+            normal = material.normalMap.modify(normal, hitPoint)
 
         # Epsilon hitPoint
         hitPointEps = hitPoint + normal * 0.0001
@@ -115,80 +325,94 @@ class RayTracer(Renderer):
         # Ambient color
         color = RGB(0.0, 0.0, 0.0)
 
+        # All shadow samples are traced as a single batch of (samplesPerShadow x N) rays, sample-major
+        samples = self.samplesPerShadow
+        size = np.size(hitPoint.x)
+        hitPoints = hitPoint.tile(samples)
+        hitPointsEps = hitPointEps.tile(samples)
+        normals = normal.tile(samples)
+        vout = (self.camera.eye - hitPoint).normalized().tile(samples)
+
+        # Material colors do not depend on the light samples
+        kd, ks = material.getColors(hitPoint)
+        kd, ks = kd.tile(samples), ks.tile(samples)
+
         # Shade for each light
-        for light in self.scene.lights:
-            contribution = RGB(0.0, 0.0, 0.0)
-            for i in range(self.samplesPerShadow):
-                # Ambient color
-                contribution += self.scene.ambient 
+        for k, light in enumerate(self.scene.lights):
+            # One light position per ray and sample
+            lightPosition, pdf = light.sample(size, samples, self.__lightSamples(pixelSamples, k), self.rng)
 
-                # To check visibility
-                direction_to_light = light.getPosition() - hitPoint
+            # To check visibility
+            direction_to_light = lightPosition.sub(hitPoints, out=self.__scratchVec3(size * samples))
 
-                # Mimimum distance used to known if primitive is coverted
-                min_distance_to_light = direction_to_light.magnitude()
+            # Mimimum distance used to known if primitive is coverted
+            min_distance_to_light = direction_to_light.magnitude()
 
-                # Build ray to light
-                ray2light = Ray(hitPointEps, direction_to_light.normalized())
+            # Compute vector in
+            vin = direction_to_light.normalized(out=self.__scratchVec3(size * samples))
 
-                # Compute distances for each primitive
-                light_distances = [p.intercept(ray2light) for p in self.scene.primitives]
+            # Build rays to light
+            ray2light = Ray(hitPointsEps, vin)
 
-                # Retrieve nearest
-                light_nearest = reduce(np.minimum, light_distances)
+            # Ilumination function (0 or 1): any primitive between hit point and light?
+            iluminated = ~self.scene.getAccelerator().occluded(ray2light, min_distance_to_light)
 
-                # Ilumination function (0 or 1)
-                iluminated = light_distances[self.scene.primitives.index(primitive)] == light_nearest
-                iluminated[light_nearest > min_distance_to_light] = True
-                
-                # Compute angles
-                alpha = np.maximum(normal.dot(direction_to_light.normalized()), 0)
+            # Compute angles
+            alpha = normals.dot(vin, out=self.scratch.get(size * samples))
+            np.maximum(alpha, 0, out=alpha)
 
-                # Distance squared to light
-                distance_squared = direction_to_light.magnitudeSquared()
+            # Light attenuation
+            lightAttenuation = 1.0/(np.pi * direction_to_light.magnitudeSquared())
 
-                # Compute vectors in/out
-                vin = direction_to_light.normalized()
-                vout = (self.camera.eye - hitPoint).normalized()
+            response = self.__brdf(kd, ks, vin, vout, normals, material)
+            # Emitted power (per area) over pdf
+            power = (light.watts / light.getArea()) / pdf
 
-                # Light attenuation
-                lightAttenuation = 1.0/(np.pi * distance_squared)
+            # Per-sample factor, applied in place
+            alpha *= power
+            alpha *= iluminated
+            alpha *= lightAttenuation
+            response *= alpha
 
-                response = self.__brdf(hitPoint, vin, vout, normal, primitive.material)
-                contribution += (response * alpha * light.watts) * iluminated * lightAttenuation
+            # Ambient color plus the mean over samplesPerShadow
+            color += self.scene.ambient
+            color += response.mean(samples)
 
-            # Weight by samplesPerShadow
-            color += contribution * (1/float(self.samplesPerShadow))
+        # Secondary rays (next bounce) and their weights
+        secondary = []
+        if not bounce:
+            return color, secondary
 
-        if primitive.material.hasReflectivity():
+        if material.hasReflectivity():
             reflectRay = Ray(hitPointEps, rays.inverted().reflect(normal))
-            color += self.__trace(reflectRay) * primitive.material.getReflectivity()
+            secondary.append((reflectRay, material.getReflectivity()))
 
-        indexRef = primitive.material.getRefractionIndex()
+        indexRef = material.getRefractionIndex()
         if indexRef != self.refractionIndex:
             refractRay = Ray(hitPoint, rays.getDirection().refract(normal, self.refractionIndex, indexRef))
-            color += self.__trace(refractRay)
+            secondary.append((refractRay, 1.0))
 
-        return color
+        return color, secondary
 
-    def __brdf(self, hitPoint, vin, vout, normal, material):
+    def __brdf(self, kd, ks, vin, vout, normal, material):
         # Getting material parameters
-        kd, ks = material.getColors(hitPoint)
         n = material.getShininess()
 
         # diffuse component
-        result = kd * (1.0/np.pi)
+        size = vin.data.shape[0]
+        result = kd.mul(1.0/np.pi, out=RGB.fromArray(self.scratch.get((size, 3))))
 
         # specular component (Phong)
         if(self.Phong):
-            sd = vin.reflect(normal)
-            alpha = np.maximum(sd.dot(vout), 0)
-            factor = pow(alpha, n)
-            result += ((ks * (n + 2.0) * factor) * (1.0/(2.0 * np.pi)))
+            sd = vin.reflect(normal, out=self.__scratchVec3(size))
+            alpha = sd.dot(vout, out=self.scratch.get(size))
         else: # specular component Blinn-Phong
-            sd = (vin + vout).normalized()
-            alpha = np.maximum(sd.dot(normal), 0)
-            factor = pow(alpha, n)
-            result += ((ks * (n + 2.0) * factor) * (1.0/(2.0 * np.pi)))
+            sd = vin.add(vout, out=self.__scratchVec3(size))
+            sd.normalized(out=sd)
+            alpha = sd.dot(normal, out=self.scratch.get(size))
+        np.maximum(alpha, 0, out=alpha)
+        factor = np.power(alpha, n, out=alpha)
+        factor *= (n + 2.0) * (1.0/(2.0 * np.pi))
+        result += ks * factor
 
         return result
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Douglas Uba'
+
+# Low-discrepancy samplers. A sampler returns values in [0, 1) for (pixel, sample index, dimension):
+# each dimension is a separate sequence over the samples of a pixel, decorrelated from the other
+# dimensions and pixels. Dimensions are used in pairs (2D samples).
+
+from abc import ABC, abstractmethod
+import numpy as np
+
+# Available samplers. RANDOM is the independent uniform sampling of np.random (no sampler).
+RANDOM = 'random'
+STRATIFIED = 'stratified'
+HALTON = 'halton'
+SOBOL = 'sobol'
+
+# Dimensions: pixel jitter, lens and then two per light and bounce (shadow samples)
+PIXEL = 0
+LENS = 2
+LIGHT = 4
+
+def create(name, samplesPerPixel, seed=0):
+    if name == RANDOM:
+        return None
+    samplers = {STRATIFIED: StratifiedSampler, HALTON: HaltonSampler, SOBOL: SobolSampler}
+    if name not in samplers:
+        raise ValueError('Unknown sampler: {}'.format(name))
+    return samplers[name](samplesPerPixel, seed)
+
+def mix(*keys):
+    # SplitMix64 of the keys (integers or integer arrays), combined in order
+    h = np.uint64(0x9E3779B97F4A7C15)
+    with np.errstate(over='ignore'):
+        for key in keys:
+            h = np.asarray(key).astype(np.uint64) ^ (h + np.uint64(0x9E3779B97F4A7C15))
+            h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            h = h ^ (h >> np.uint64(31))
+    return h
+
+def uniform(h):
+    # Hash values to [0, 1)
+    return (h >> np.uint64(11)).astype(np.float64) * 2.0**-53
+
+def permute(i, l, p):
+    # Element i of a random permutation of range(l), chosen by p (Kensler, Correlated Multi-Jittered Sampling)
+    shape = np.broadcast_shapes(np.shape(i), np.shape(p))
+    i, p = (a.astype(np.uint32).ravel() for a in np.broadcast_arrays(i, np.asarray(p) & 0xFFFFFFFF))
+    w = l - 1
+    for shift in (1, 2, 4, 8, 16):
+        w |= w >> shift
+    w = np.uint32(w)
+    # Hashing is repeated (cycle walking) until the value is in range(l)
+    active = np.arange(i.shape[0])
+    while active.shape[0]:
+        x, q = i[active], p[active]
+        x ^= q
+        x *= np.uint32(0xe170893d)
+        x ^= q >> 16
+        x ^= (x & w) >> 4
+        x ^= q >> 8
+        x *= np.uint32(0x0929eb3f)
+        x ^= q >> 23
+        x ^= (x & w) >> 1
+        x *= np.uint32(1) | q >> 27
+        x *= np.uint32(0x6935fa69)
+        x ^= (x & w) >> 11
+        x *= np.uint32(0x74dcb303)
+        x ^= (x & w) >> 2
+        x *= np.uint32(0x9e501cc3)
+        x ^= (x & w) >> 2
+        x *= np.uint32(0xc860a3df)
+        x &= w
+        x ^= x >> 5
+        i[active] = x
+        active = active[x >= l]
+    return ((i.astype(np.uint64) + p) % np.uint64(l)).astype(np.int64).reshape(shape)
+
+def reverseBits(v):
+    # Bit reversal of 32-bit integers
+    v = ((v >> 1) & np.uint32(0x55555555)) | ((v & np.uint32(0x55555555)) << 1)
+    v = ((v >> 2) & np.uint32(0x33333333)) | ((v & np.uint32(0x33333333)) << 2)
+    v = ((v >> 4) & np.uint32(0x0F0F0F0F)) | ((v & np.uint32(0x0F0F0F0F)) << 4)
+    v = ((v >> 8) & np.uint32(0x00FF00FF)) | ((v & np.uint32(0x00FF00FF)) << 8)
+    return (v >> 16) | (v << 16)
+
+def owenScramble(v, seed):
+    # Nested uniform (Owen) scrambling of 32-bit fixed-point values, hash-based (Laine and Karras)
+    seed = (np.asarray(seed) & 0xFFFFFFFF).astype(np.uint32)
+    v = reverseBits(v)
+    with np.errstate(over='ignore'):
+        v ^= v * np.uint32(0x3d20adea)
+        v += seed
+        v *= (seed >> 16) | np.uint32(1)
+        v ^= v * np.uint32(0x05526c56)
+        v ^= v * np.uint32(0x53a22864)
+    return reverseBits(v)
+
+class Sampler(ABC):
+    def __init__(self, samplesPerPixel, seed=0):
+        self.samplesPerPixel = samplesPerPixel
+        self.seed = seed
+
+    @abstractmethod
+    def get2D(self, pixels, index, dimension, count=None):
+        # Values (u, v) of dimensions (dimension, dimension + 1) for the sample index of each pixel.
+        # count is the length of the sequence of each pixel (samplesPerPixel, by default).
+        pass
+
+class StratifiedSampler(Sampler):
+    # Jittered samples, one per stratum of each dimension (Latin hypercube), strata in a random order per pixel
+    def get2D(self, pixels, index, dimension, count=None):
+        count = self.samplesPerPixel if count is None else count
+        pixels, index = np.broadcast_arrays(pixels, index)
+        values = []
+        for d in (dimension, dimension + 1):
+            h = mix(self.seed, d, pixels)
+            stratum = permute(index, count, h)
+            values.append((stratum + uniform(mix(h, index))) / count)
+        return values
+
+class HaltonSampler(Sampler):
+    # 2D Halton points (bases 2 and 3) per pair of dimensions, padded like SobolSampler and
+    # Owen-scrambled: each digit is shifted by a random amount that depends on the previous digits
+    BASES = (2, 3)
+
+    def __radicalInverse(self, index, count, base, h):
+        # Digits of indices below count are scrambled, the remaining ones (all zero) are a uniform offset.
+        # Digits are shifted in unsigned integer arithmetic (exact).
+        value, scale = np.zeros(index.shape), 1.0 / base
+        index, b = index.astype(np.uint64), np.uint64(base)
+        while count > 0:
+            digit = index % b
+            value += ((digit + mix(h) % b) % b) * scale
+            h = mix(h, digit)
+            index = index // b
+            count //= base
+            scale /= base
+        value += uniform(mix(h)) * scale * base
+        return np.minimum(value, 1.0 - 2.0**-53)
+
+    def get2D(self, pixels, index, dimension, count=None):
+        count = self.samplesPerPixel if count is None else count
+        pixels, index = np.broadcast_arrays(pixels, index)
+        h = mix(self.seed, dimension, pixels)
+        index = permute(index, count, h)
+        return [self.__radicalInverse(index, count - 1, base, mix(h, d)) for d, base in enumerate(self.BASES)]
+
+class SobolSampler(Sampler):
+    # Owen-scrambled 2D Sobol points per pair of dimensions, padded: the index is randomly permuted
+    # per pixel and pair of dimensions, so pairs are decorrelated from each other
+    def __init__(self, samplesPerPixel, seed=0):
+        super().__init__(samplesPerPixel, seed)
+        # Direction numbers of the first two dimensions: van der Corput and v[k] = v[k-1] ^ (v[k-1] >> 1)
+        self.directions = np.zeros((2, 32), dtype=np.uint32)
+        v = 1 << 31
+        for k in range(32):
+            self.directions[:, k] = (1 << (31 - k), v)
+            v ^= v >> 1
+
+    def get2D(self, pixels, index, dimension, count=None):
+        count = self.samplesPerPixel if count is None else count
+        pixels, index = np.broadcast_arrays(pixels, index)
+        h = mix(self.seed, dimension, pixels)
+        index = permute(index, count, h).astype(np.uint32)
+        values = []
+        for d in range(2):
+            v = np.zeros(index.shape, dtype=np.uint32)
+            # Bits of indices below count (the scrambling randomizes the lower ones)
+            for k in range(max(1, int(count - 1).bit_length())):
+                v ^= ((index >> k) & np.uint32(1)) * self.directions[d, k]
+            v = owenScramble(v, mix(h, d))
+            values.append(v.astype(np.float64) * 2.0**-32)
+        return values
@@ -2,21 +2,30 @@
 
 __author__ = 'Douglas Uba'
 
+import hashlib
 import json
+import os
+import numpy as np
+from rayden import archive, floats
+from rayden.accelerator import BVHAccelerator, PrimitiveList
 from rayden.constants import AIR_REFRACTION_INDEX
-from rayden.primitives import Plane, Sphere, Torus, Triangle
+from rayden.primitives import Plane, PlaneSet, Sphere, SphereSet, Torus, Triangle, TriangleMesh
 from rayden.lights import AreaLightSource, PointLightSource
 from rayden.camera import Camera
 from rayden.color import RGB
-from rayden.material import Checkerboard, Material
+from rayden.material import Checkerboard, Material, NormalMap, Turbulence, Wood
 from rayden.vector import Vec3
 
 class Scene():
-    def __init__(self, camera, ambient=RGB(0.0, 0.0, 0.0)):
+    # Below this number of primitives, testing all of them is cheaper than traversing a BVH
+    BVH_MIN_PRIMITIVES = 8
+
+    def __init__(self, camera, ambient=None):
         self.camera = camera
         self.lights = []
         self.primitives = []
-        self.ambient = ambient
+        self.accelerator = None
+        self.ambient = RGB(0.0, 0.0, 0.0) if ambient is None else ambient
 
     def getCamera(self):
         return self.camera
@@ -29,22 +38,120 @@ class Scene():
 
     def addPrimitive(self, p):
         self.primitives.append(p)
+        self.accelerator = None
 
     def setPrimitives(self, primitives):
         self.primitives = primitives
+        self.build()
+
+    def setAccelerator(self, accelerator):
+        self.accelerator = accelerator
+
+    def build(self):
+        if len(self.primitives) < Scene.BVH_MIN_PRIMITIVES:
+            self.accelerator = PrimitiveList(self.primitives)
+        else:
+            self.accelerator = BVHAccelerator(self.primitives)
+
+    def getAccelerator(self):
+        if self.accelerator is None:
+            self.build()
+        return self.accelerator
+
+# Hash of the rayden sources (computed once)
+_code = None
 
 class Reader():
+    # Extension of compiled scenes
+    COMPILED = '.rdz'
+
     @staticmethod
-    def read(file):
-        with open(file) as f:
-            return Reader.readScene(json.load(f))
+    def read(file, cache=None):
+        # Compiled scenes are loaded as they were built. cache: directory of compiled scenes (none, by default),
+        # reused while the scene file, its meshes, the precision and the rayden sources are the same.
+        if os.path.splitext(file)[1].lower() == Reader.COMPILED:
+            return Reader.load(file)
+        with open(file, 'rb') as f:
+            source = f.read()
+        data = json.loads(source)
+        # External files (e.g. meshes) are relative to the scene file (absolute paths, as compiled
+        # scenes may be loaded from other working directories)
+        path = os.path.dirname(os.path.abspath(file))
+        if cache is None:
+            return Reader.readScene(data, path)
+        digest = Reader.digest(source, data, path)
+        compiled = os.path.join(cache, '{}-{}{}'.format(os.path.splitext(os.path.basename(file))[0], digest[:16], Reader.COMPILED))
+        if os.path.exists(compiled):
+            return Reader.load(compiled)
+        scene = Reader.readScene(data, path)
+        os.makedirs(cache, exist_ok=True)
+        Reader.save(scene, compiled, digest)
+        return scene
+
+    @staticmethod
+    def compile(file, output=None):
+        # Scene file to a compiled scene (built primitives, precomputed geometry and BVHs), next to it by default
+        output = os.path.splitext(file)[0] + Reader.COMPILED if output is None else output
+        with open(file, 'rb') as f:
+            source = f.read()
+        data = json.loads(source)
+        path = os.path.dirname(os.path.abspath(file))
+        Reader.save(Reader.readScene(data, path), output, Reader.digest(source, data, path))
+        return output
 
     @staticmethod
-    def readScene(data):
+    def codeDigest():
+        # Compiled scenes are pickled objects (primitives, BVHs, materials): they are only valid
+        # for the sources that built them
+        global _code
+        if _code is None:
+            h = hashlib.sha1()
+            root = os.path.dirname(os.path.abspath(__file__))
+            for directory, folders, files in os.walk(root):
+                folders.sort()
+                for name in sorted(f for f in files if f.endswith('.py')):
+                    file = os.path.join(directory, name)
+                    h.update(os.path.relpath(file, root).encode())
+                    with open(file, 'rb') as f:
+                        h.update(f.read())
+            _code = h.hexdigest()
+        return _code
+
+    @staticmethod
+    def digest(source, data, path='.'):
+        # Content hash of a scene: its file, the mesh files it reads, the precision and the rayden sources
+        h = hashlib.sha1(json.dumps([Reader.codeDigest(), floats.getPrecision()]).encode())
+        h.update(source)
+        for obj in data['objects']:
+            if obj['type'] == 'mesh':
+                with open(os.path.join(path, obj['file']), 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        h.update(block)
+        return h.hexdigest()
+
+    @staticmethod
+    def save(scene, file, digest=None):
+        scene.getAccelerator()
+        header = {'code': Reader.codeDigest(), 'precision': floats.getPrecision(), 'digest': digest}
+        archive.save(file, scene, header)
+
+    @staticmethod
+    def load(file):
+        # Checked before the objects are loaded (they may not match the current classes)
+        header = archive.readHeader(file)
+        if header.get('code') != Reader.codeDigest():
+            raise ValueError('Scene compiled by other rayden sources, compile it again: {}'.format(file))
+        if header['precision'] != floats.getPrecision():
+            raise ValueError('Compiled scene in {} precision, rendering in {}: {}'.format(
+                header['precision'], floats.getPrecision(), file))
+        return archive.load(file)[1]
+
+    @staticmethod
+    def readScene(data, path='.'):
         camera = Reader.readCamera(data['camera'])
         scene = Scene(camera, Reader.readRGB(data['ambient']))
         scene.setLightSources(Reader.readLights(data['lights']))
-        scene.setPrimitives(Reader.readObjects(data['objects']))
+        scene.setPrimitives(Reader.readObjects(data['objects'], path))
         return scene
         
     @staticmethod
@@ -63,7 +170,7 @@ class Reader():
         lookAt = Reader.readVec3(data['lookAt'])
         up = Reader.readVec3(data['up'])
         width, height = data['width'], data['height']
-        return Camera(eye, lookAt, up, width, height)
+        return Camera(eye, lookAt, up, width, height, data.get('aperture', 0.0), data.get('focalDistance'))
 
     @staticmethod
     def readLights(data):
@@ -80,33 +187,224 @@ class Reader():
         return lights
 
     @staticmethod
-    def readObjects(data):
+    def readObjects(data, path='.', group=True):
         objects = []
+        # Objects with the same material description share the same Material
+        materials = {}
+        def sharedMaterial(obj):
+            key = json.dumps(obj['material'], sort_keys=True)
+            if key not in materials:
+                materials[key] = Reader.readMaterial(obj['material'])
+            return materials[key]
         for obj in data:
             if obj['type'] == 'sphere':
                 sphere = Sphere(Reader.readVec3(obj['center']), obj['radius'])
-                sphere.setMaterial(Reader.readMaterial(obj['material']))
+                sphere.setMaterial(sharedMaterial(obj))
                 objects.append(sphere)
             elif obj['type'] == 'plane':
                 plane = Plane(Reader.readVec3(obj['normal']), obj['distance'])
-                plane.setMaterial(Reader.readMaterial(obj['material']))
+                plane.setMaterial(sharedMaterial(obj))
                 objects.append(plane)
             elif obj['type'] == 'triangle':
                 triangle = Triangle(Reader.readVec3(obj['a']), Reader.readVec3(obj['b']), Reader.readVec3(obj['c']))
-                triangle.setMaterial(Reader.readMaterial(obj['material']))
+                triangle.setMaterial(sharedMaterial(obj))
                 objects.append(triangle)
             elif obj['type'] == 'torus':
                 torus = Torus(obj['sweptRadius'], obj['tubeRadius'])
-                torus.setMaterial(Reader.readMaterial(obj['material']))
+                torus.setMaterial(sharedMaterial(obj))
                 objects.append(torus)
-        return objects
+            elif obj['type'] == 'mesh':
+                vertices, faces = Reader.readMesh(os.path.join(path, obj['file']))
+                mesh = TriangleMesh(vertices, faces, obj.get('smooth', False))
+                mesh.setMaterial(sharedMaterial(obj))
+                objects.append(mesh)
+        # Procedural textures are baked over the bounds of all objects that use them
+        for key, material in materials.items():
+            bounds = [o.getBounds() for o in objects if o.getMaterial() is material]
+            Reader.bakeMaterial(json.loads(key), material, bounds, path)
+        return Reader.groupObjects(objects) if group else objects
+
+    # Fewer same-type primitives are faster as single objects (nothing to amortize the set bookkeeping)
+    GROUP_MIN_MEMBERS = 5
+
+    @staticmethod
+    def groupObjects(objects):
+        # Same-type primitives (spheres and planes) as structure-of-arrays sets
+        grouped = list(objects)
+        for (kind, build) in ((Sphere, SphereSet.fromSpheres), (Plane, PlaneSet.fromPlanes)):
+            members = [o for o in grouped if type(o) is kind]
+            if len(members) < Reader.GROUP_MIN_MEMBERS:
+                continue
+            primitiveSet = build(members)
+            materials = list({id(m.material): m.material for m in members}.values())
+            primitiveSet.setMaterials(materials, [materials.index(m.material) for m in members])
+            # The set takes the place of its first member
+            first = grouped.index(members[0])
+            grouped = [o for o in grouped if type(o) is not kind]
+            grouped.insert(first, primitiveSet)
+        return grouped
+
+
+    @staticmethod
+    def readMesh(file):
+        extension = os.path.splitext(file)[1].lower()
+        if extension == '.obj':
+            return Reader.readOBJ(file)
+        elif extension == '.ply':
+            return Reader.readPLY(file)
+        raise ValueError('Unsupported mesh format: {}'.format(file))
+
+    @staticmethod
+    def __triangulate(polygon):
+        # Fan triangulation
+        return [(polygon[0], polygon[i], polygon[i + 1]) for i in range(1, len(polygon) - 1)]
+
+    @staticmethod
+    def readOBJ(file):
+        vertices, faces = [], []
+        with open(file) as f:
+            for line in f:
+                if line.startswith('v '):
+                    vertices.append(line.split()[1:4])
+                elif line.startswith('f '):
+                    # Indices are 1-based, negative ones are relative to the current vertex
+                    polygon = [int(v.split('/')[0]) for v in line.split()[1:]]
+                    polygon = [i - 1 if i > 0 else len(vertices) + i for i in polygon]
+                    faces.extend(Reader.__triangulate(polygon))
+        return np.array(vertices, dtype=np.float64).reshape(-1, 3), np.array(faces, dtype=np.int64).reshape(-1, 3)
+
+    # PLY property types
+    PLY_TYPES = {
+        'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+        'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+        'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+        'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8'
+    }
+
+    @staticmethod
+    def readPLY(file):
+        with open(file, 'rb') as f:
+            if f.readline().strip() != b'ply':
+                raise ValueError('Invalid PLY file: {}'.format(file))
+            # Header: format and elements, i.e. (name, count, properties)
+            form, elements = None, []
+            while True:
+                tokens = f.readline().decode('ascii').split()
+                if not tokens or tokens[0] == 'end_header':
+                    break
+                if tokens[0] == 'format':
+                    form = tokens[1]
+                elif tokens[0] == 'element':
+                    elements.append((tokens[1], int(tokens[2]), []))
+                elif tokens[0] == 'property':
+                    elements[-1][2].append(tokens[1:])
+            data = f.read()
+        if form == 'ascii':
+            return Reader.__readPLYAscii(data.decode('ascii').split('\n'), elements)
+        return Reader.__readPLYBinary(data, '<' if form == 'binary_little_endian' else '>', elements)
+
+    # Names of the vertex index list of faces
+    PLY_INDICES = ('vertex_indices', 'vertex_index')
+
+    @staticmethod
+    def __plyIndices(properties):
+        # Position of the vertex index list among the face properties: by name, or the only list.
+        # Other properties (e.g. flags, colors, texture coordinates) are skipped.
+        lists = [k for k, p in enumerate(properties) if p[0] == 'list']
+        named = [k for k in lists if properties[k][-1] in Reader.PLY_INDICES]
+        if not named and len(lists) != 1:
+            raise ValueError('PLY faces without a vertex index list')
+        return (named or lists)[0]
+
+    @staticmethod
+    def __readPLYAscii(lines, elements):
+        vertices, faces, offset = None, [], 0
+        for name, count, properties in elements:
+            block = lines[offset:offset + count]
+            offset += count
+            if name == 'vertex':
+                names = [p[-1] for p in properties]
+                values = np.array(' '.join(block).split(), dtype=np.float64).reshape(count, -1)
+                vertices = values[:, [names.index(c) for c in 'xyz']]
+            elif name == 'face':
+                index = Reader.__plyIndices(properties)
+                for line in block:
+                    tokens, position = line.split(), 0
+                    # Scalars are one token, lists are their size followed by their items
+                    for k, p in enumerate(properties):
+                        n = int(tokens[position]) if p[0] == 'list' else 0
+                        if k == index:
+                            faces.extend(Reader.__triangulate([int(i) for i in tokens[position + 1:position + 1 + n]]))
+                        position += n + 1
+        return vertices, np.array(faces, dtype=np.int64).reshape(-1, 3)
+
+    @staticmethod
+    def __readPLYBinary(data, endian, elements):
+        vertices, faces, offset = None, None, 0
+        types = lambda *names: [np.dtype(endian + Reader.PLY_TYPES[t]) for t in names]
+        for name, count, properties in elements:
+            if all(p[0] != 'list' for p in properties):
+                dtype = np.dtype([(p[1], endian + Reader.PLY_TYPES[p[0]]) for p in properties])
+                values = np.frombuffer(data, dtype, count, offset)
+                offset += count * dtype.itemsize
+                if name == 'vertex':
+                    vertices = np.stack([values[c].astype(np.float64) for c in 'xyz'], axis=1)
+                continue
+            index = Reader.__plyIndices(properties) if name == 'face' else None
+            # Fast path: triangles, when the index list is the only list (fixed size records)
+            if index is not None and sum(p[0] == 'list' for p in properties) == 1:
+                fields = []
+                for k, p in enumerate(properties):
+                    if k == index:
+                        countType, indexType = types(*p[1:3])
+                        fields += [('n', countType), ('indices', indexType, 3)]
+                    else:
+                        fields.append(('p{}'.format(k), types(p[0])[0]))
+                dtype = np.dtype(fields)
+                values = np.frombuffer(data, dtype, count, offset) if count * dtype.itemsize <= len(data) - offset else None
+                if values is not None and np.all(values['n'] == 3):
+                    faces = values['indices'].astype(np.int64)
+                    offset += count * dtype.itemsize
+                    continue
+            # Generic records: polygons, other lists (skipped) and lists of other elements
+            layout = [types(*p[1:3]) if p[0] == 'list' else types(p[0]) for p in properties]
+            polygons = []
+            for i in range(count):
+                for k, p in enumerate(layout):
+                    if len(p) == 1:
+                        offset += p[0].itemsize
+                        continue
+                    countType, itemType = p
+                    n = int(np.frombuffer(data, countType, 1, offset)[0])
+                    offset += countType.itemsize
+                    if k == index:
+                        polygons.extend(Reader.__triangulate(np.frombuffer(data, itemType, n, offset).tolist()))
+                    offset += n * itemType.itemsize
+            if index is not None:
+                faces = np.array(polygons, dtype=np.int64).reshape(-1, 3)
+        return vertices, faces
+
+    # Procedural materials. Colors and scale not given in the scene are the class defaults.
+    PROCEDURAL = {
+        'wood': Wood,
+        'turbulence': Turbulence
+    }
 
     @staticmethod
     def readMaterial(data):
+        procedural = [name for name in Reader.PROCEDURAL if name in data]
         if 'checkerboard' in data:
             scale = data['checkerboard'].get('scale', 5.0)
             material = Checkerboard(Reader.readRGB(data['checkerboard']['color1']),
                 Reader.readRGB(data['checkerboard']['color2']), scale)
+        elif procedural:
+            texture = data[procedural[0]]
+            options = {key: Reader.readRGB(texture[key]) for key in ('color1', 'color2') if key in texture}
+            if 'scale' in texture:
+                options['scale'] = texture['scale']
+            material = Reader.PROCEDURAL[procedural[0]](**options)
+            if 'octaves' in texture:
+                material.numberOfOctaves = texture['octaves']
         else:
             diffuse = Reader.readRGB(data['diffuse'])
             material = Material(diffuse)
@@ -115,4 +413,27 @@ class Reader():
         material.shininess = data.get('shininess', 0.0)
         material.reflectivity = data.get('reflectivity', 0.0)
         material.refractionIndex = data.get('refractionIndex', AIR_REFRACTION_INDEX)
+        if 'normalMap' in data:
+            material.normalMap = NormalMap(data['normalMap'].get('scale', 1.0), data['normalMap'].get('amount', 0.1))
         return material
+
+    @staticmethod
+    def bakeMaterial(data, material, bounds, path='.'):
+        # Optional baked noise volumes: {"bake": {"resolution": 64, "cache": "directory", "bounds": [lower, upper]}}
+        # inside of a procedural texture or normal map description
+        textures = [(data[name], material) for name in Reader.PROCEDURAL if name in data]
+        if 'normalMap' in data:
+            textures.append((data['normalMap'], material.normalMap))
+        for description, texture in textures:
+            if 'bake' not in description:
+                continue
+            options = description['bake']
+            if 'bounds' in options:
+                lower, upper = options['bounds']
+            elif bounds and all(b is not None for b in bounds):
+                lower = np.min([b[0].components() for b in bounds], axis=0)
+                upper = np.max([b[1].components() for b in bounds], axis=0)
+            else:
+                raise ValueError('Baked textures of unbounded objects (e.g. planes) require "bounds"')
+            directory = os.path.join(path, options['cache']) if 'cache' in options else None
+            texture.bake(lower, upper, options.get('resolution', 64), directory)
@@ -4,15 +4,57 @@ __author__ = 'Douglas Uba'
 
 import numbers
 import numpy as np
+from rayden import floats
 
 def extract(cond, x):
     if isinstance(x, numbers.Number): return x
-    return np.extract(cond, x)
+    # cond is a boolean mask or an index array
+    return np.asarray(x)[cond]
 
-def vec2np(vec):
-    return np.array((vec.x, vec.y, vec.z))
+def pack(x, y, z):
+    # Components as a single contiguous (N, 3) array, or (3,) if all of them are scalars, in the render precision
+    return np.stack(np.broadcast_arrays(x, y, z), axis=-1).astype(floats.dtype(), copy=False)
 
-def np2vec(array):
-    from rayden.vector import Vec3
-    return Vec3(array[0], array[1], array[2])
-    
\ No newline at end of file
+def column(x):
+    # Per-vector factor, broadcasted over the three components of (N, 3) arrays
+    return x if np.ndim(x) == 0 else np.asarray(x)[..., np.newaxis]
+
+def apply(cls, ufunc, a, b, out=None):
+    # Packed (Vec3, RGB) operation, written into out if given
+    if out is None:
+        return cls.fromArray(ufunc(a, b))
+    ufunc(a, b, out=out.data)
+    return out
+
+def inplace(packed, ufunc, other):
+    # In-place packed operation. Falls back to a new array if the result does not fit (e.g. scalar += array).
+    if packed.data.flags.writeable and np.broadcast_shapes(packed.data.shape, np.shape(other)) == packed.data.shape:
+        ufunc(packed.data, other, out=packed.data)
+    else:
+        packed.data = ufunc(packed.data, other)
+    return packed
+
+class ScratchPool():
+    # Temporary buffers reused across calls: after a reset, the k-th request gets the k-th buffer again
+    # (grown as needed). Buffers are only valid until the next reset.
+    def __init__(self):
+        self.buffers = []
+        self.next = 0
+
+    def reset(self):
+        self.next = 0
+
+    def get(self, shape, dtype=None):
+        dtype = floats.dtype() if dtype is None else dtype
+        size = int(np.prod(shape))
+        if self.next == len(self.buffers):
+            self.buffers.append(np.empty(0, dtype=dtype))
+        buffer = self.buffers[self.next]
+        if buffer.size < size or buffer.dtype != dtype:
+            buffer = self.buffers[self.next] = np.empty(max(size, buffer.size), dtype=dtype)
+        self.next += 1
+        return buffer[:size].reshape(shape)
+
+    def __getstate__(self):
+        # Do not copy the buffers (e.g. to worker processes)
+        return {'buffers': [], 'next': 0}
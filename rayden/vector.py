@@ -3,31 +3,80 @@
 __author__ = 'Douglas Uba'
 
 import numpy as np
-from rayden.utils import extract, vec2np, np2vec
+from rayden import floats
+from rayden.utils import apply, column, inplace, pack
 
 class Vec3():
+    # Components packed in a single contiguous array: (N, 3) for N vectors or (3,) for a single one
+    __slots__ = ('data',)
+
     def __init__(self, x=1.0, y=1.0, z=1.0):
-        (self.x, self.y, self.z) = (x, y, z)
+        self.data = pack(x, y, z)
+
+    @staticmethod
+    def fromArray(data):
+        # Wraps an (N, 3) or (3,) array, without copying
+        v = Vec3.__new__(Vec3)
+        v.data = data
+        return v
+
+    @staticmethod
+    def empty(size):
+        return Vec3.fromArray(np.empty((size, 3), dtype=floats.dtype()))
+
+    def __component(self, k):
+        return self.data[k] if self.data.ndim == 1 else self.data[:, k]
+
+    def __setComponent(self, k, value):
+        components = list(self.components())
+        components[k] = value
+        self.data = pack(*components)
+
+    x = property(lambda self: self.__component(0), lambda self, value: self.__setComponent(0, value))
+    y = property(lambda self: self.__component(1), lambda self, value: self.__setComponent(1, value))
+    z = property(lambda self: self.__component(2), lambda self, value: self.__setComponent(2, value))
+
+    def add(self, other, out=None):
+        return apply(Vec3, np.add, self.data, other.data, out)
+
+    def sub(self, other, out=None):
+        return apply(Vec3, np.subtract, self.data, other.data, out)
+
+    def mul(self, other, out=None):
+        return apply(Vec3, np.multiply, self.data, column(other), out)
 
     def __add__(self, other):
-        return Vec3(self.x + other.x, self.y + other.y, self.z + other.z)
+        return self.add(other)
 
     def __sub__(self, other):
-        return Vec3(self.x - other.x, self.y - other.y, self.z - other.z)
+        return self.sub(other)
 
     def __mul__(self, other):
-        return Vec3(self.x * other, self.y * other, self.z * other)
+        return self.mul(other)
 
     def __div__(self, other):
-        return Vec3(self.x / other, self.y / other, self.z / other)
+        return apply(Vec3, np.divide, self.data, column(other))
+
+    def __iadd__(self, other):
+        return inplace(self, np.add, other.data)
 
-    def dot(self, other):
-        return (self.x * other.x) + (self.y * other.y) + (self.z * other.z)
+    def __isub__(self, other):
+        return inplace(self, np.subtract, other.data)
 
-    def cross(self, other):
-        return Vec3(self.y * other.z - self.z * other.y,
-                    self.z * other.x - self.x * other.z,
-                    self.x * other.y - self.y * other.x)
+    def __imul__(self, other):
+        return inplace(self, np.multiply, column(other))
+
+    def dot(self, other, out=None):
+        return np.einsum('...i,...i->...', self.data, other.data, out=out)
+
+    def cross(self, other, out=None):
+        a, b = self.data, other.data
+        out = Vec3.fromArray(np.empty(np.broadcast_shapes(a.shape, b.shape), dtype=np.result_type(a, b))) if out is None else out
+        for k, (i, j) in enumerate(((1, 2), (2, 0), (0, 1))):
+            c = out.data[..., k]
+            np.multiply(a[..., i], b[..., j], out=c)
+            c -= a[..., j] * b[..., i]
+        return out
 
     def __abs__(self):
         return self.dot(self)
@@ -39,71 +88,64 @@ class Vec3():
         return self.dot(self)
 
     def normalize(self):
-        norm = self.magnitude()
-        (self.x, self.y, self.z) = (self.x / norm, self.y / norm, self.z / norm)
+        self.normalized(out=self if self.data.flags.writeable else None)
 
-    def normalized(self):
-        mag = np.sqrt(abs(self))
-        return self * (1.0 / np.where(mag == 0, 1, mag))
+    def normalized(self, out=None):
+        mag = self.magnitude()
+        return self.mul(1.0 / np.where(mag == 0, 1, mag), out)
 
     def invert(self):
-        (self.x, self.y, self.z) = (-self.x, -self.y, -self.z)
+        self.data = -self.data
 
     def inverted(self):
-       return self * -1
+       return Vec3.fromArray(-self.data)
 
     def angle(self, other):
         return np.arccos(self.dot(other))
 
     def loadUnit(self):
-        (self.x, self.y, self.z) = (1.0, 1.0, 1.0)
+        self.data = pack(1.0, 1.0, 1.0)
+
+    def copy(self):
+        return Vec3.fromArray(self.data.copy())
 
     def extract(self, cond):
-        return Vec3(extract(cond, self.x), extract(cond, self.y), extract(cond, self.z))
+        return self.copy() if self.data.ndim == 1 else Vec3.fromArray(self.data[cond])
+
+    def take(self, index):
+        return self.copy() if self.data.ndim == 1 else Vec3.fromArray(self.data[index])
+
+    def tile(self, reps):
+        return self.copy() if self.data.ndim == 1 else Vec3.fromArray(np.tile(self.data, (reps, 1)))
 
-    def reflect(self, normal):
-        return (((normal * self.dot(normal)) * 2) - self).normalized()
+    def reflect(self, normal, out=None):
+        out = normal.mul(2.0 * self.dot(normal), out)
+        out -= self
+        return out.normalized(out=out)
 
     def refract(self, normal, n1, n2):
         # for self.dot(normal) < 0.0
         # wi incident on front-side of surface
-        norm = vec2np(normal)
-        n = np.full(normal.x.shape, n2/n1)
-
         # for self.dot(normal) >= 0.0
         # wi incident on back-side of surface
         pred = self.dot(normal) >= 0.0
-        norm = np.where(pred, -1 * norm, norm)
-        n = np.where(pred, n1/n2, n)
+        norm = Vec3.fromArray(np.where(column(pred), -normal.data, normal.data))
+        n = np.where(pred, n1/n2, n2/n1).astype(self.data.dtype)
 
         w = self.inverted()
-        d = w.dot(np2vec(norm))
+        d = w.dot(norm)
         det = 1 - (n * n) * (1 - d * d)
 
         # Guard
         det = np.where(det < 0.0, 0.0, det)
 
-        norm = np2vec(norm)
-        
         # Compute refract ray
         refract = (((w - (norm * d)) * -n) - (norm * np.sqrt(det))).normalized()
-         
-        # For total reflection case
-        reflect = vec2np(w.reflect(normal))
 
-        # Adjusting...
-        refract = vec2np(refract)
-        refract = np.where(det == 0.0, reflect, refract)
-        refract = np2vec(refract)
-
-        return refract
+        # For total reflection case
+        reflect = w.reflect(normal)
 
-    def place(self, cond):
-        r = Vec3(np.zeros(cond.shape), np.zeros(cond.shape), np.zeros(cond.shape))
-        np.place(r.x, cond, self.x)
-        np.place(r.y, cond, self.y)
-        np.place(r.z, cond, self.z)
-        return r
+        return Vec3.fromArray(np.where(column(det == 0.0), reflect.data, refract.data))
 
     def components(self):
         return (self.x, self.y, self.z)
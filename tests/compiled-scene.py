@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Douglas Uba'
+
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from rayden.render import RayTracer
+from rayden.scene import Reader
+
+def writeScene(directory, rng):
+    # Sphere mesh (12.8k triangles), 3000 small spheres with a few materials, a baked texture and a plane
+    n = 81
+    theta, phi = np.meshgrid(np.linspace(0.0, np.pi, n), np.linspace(0.0, 2.0 * np.pi, n), indexing='ij')
+    vertices = np.stack([np.sin(theta) * np.cos(phi), np.cos(theta), np.sin(theta) * np.sin(phi)], axis=-1).reshape(-1, 3)
+    i = (np.arange(n - 1)[:, np.newaxis] * n + np.arange(n - 1)).ravel()
+    faces = np.concatenate([np.stack([i, i + n, i + 1], axis=1), np.stack([i + 1, i + n, i + n + 1], axis=1)])
+    with open(os.path.join(directory, 'sphere.obj'), 'w') as f:
+        f.writelines('v {} {} {}\n'.format(*v) for v in vertices * 1.5 + (0.0, 1.5, 3.0))
+        f.writelines('f {} {} {}\n'.format(*t) for t in faces + 1)
+    turbulence = {'turbulence': {'scale': 4, 'bake': {'resolution': 32, 'cache': 'noise'}}}
+    objects = [{'type': 'mesh', 'file': 'sphere.obj', 'smooth': True, 'material': turbulence}]
+    objects += [{'type': 'sphere', 'center': c.tolist(), 'radius': 0.05, 'material': {'diffuse': ['red', 'green', 'blue'][k % 3]}}
+                for k, c in enumerate(rng.uniform((-5.0, 0.0, 0.0), (5.0, 3.0, 10.0), (3000, 3)))]
+    objects.append({'type': 'plane', 'normal': [0, 1, 0], 'distance': 0, 'material': {'diffuse': 'white'}})
+    scene = {'camera': {'eye': [0, 2, -6], 'lookAt': [0, 1, 3], 'up': [0, 1, 0], 'width': 48, 'height': 48},
+             'ambient': [0.1, 0.1, 0.1],
+             'lights': [{'type': 'area', 'color': 'white', 'watts': 1,
+                         'v1': [-1, 6, -1], 'v2': [1, 6, -1], 'v3': [1, 6, 1], 'v4': [-1, 6, 1]}],
+             'objects': objects}
+    file = os.path.join(directory, 'scene.json')
+    with open(file, 'w') as f:
+        json.dump(scene, f)
+    return file
+
+def load(file, cache=None):
+    start = time.perf_counter()
+    scene = Reader.read(file, cache)
+    return scene, time.perf_counter() - start
+
+def render(scene):
+    return RayTracer(scene, samplesPerPixel=2, samplesPerShadow=2, processes=1, seed=1).render()
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        file = writeScene(directory, np.random.default_rng(0))
+        cache = os.path.join(directory, 'cache')
+        scene, elapsed = load(file)
+        expected = np.asarray(render(scene))
+        print('    {:28s} load {:6.3f} s'.format('scene file', elapsed))
+
+        compiled = Reader.compile(file)
+        for name, (scene, elapsed) in (('compiled scene', load(compiled)),
+                                       ('cache (stored)', load(file, cache)),
+                                       ('cache (reused)', load(file, cache))):
+            identical = np.array_equal(np.asarray(render(scene)), expected)
+            print('    {:28s} load {:6.3f} s  identical {}'.format(name, elapsed, identical))
+        print('    {:28s} {}'.format('cached files', len(os.listdir(cache))))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Douglas Uba'
+
+import os
+import tempfile
+import numpy as np
+from rayden.scene import Reader
+
+# Unit quad, split in two triangles (fan triangulation)
+VERTICES = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [1.0, 1.0, 0.0], [0.0, 1.0, 0.0]])
+FACES = np.array([[0, 1, 2], [0, 2, 3]])
+
+def obj():
+    return ''.join('v {} {} {}\n'.format(*v) for v in VERTICES) + 'f 1/1/1 2/2/1 -2/3/1 -1/4/1\n'
+
+def plyHeader(form, faceProperties):
+    return ('ply\nformat {} 1.0\nelement vertex 4\nproperty float x\nproperty float y\nproperty float z\n'
+            'element face {{}}\n{}end_header\n').format(form, ''.join('property {}\n'.format(p) for p in faceProperties))
+
+def plyAscii():
+    # Quad with extra face properties (flags before and a texture coordinate list after the indices)
+    header = plyHeader('ascii', ['uchar flags', 'list uchar int vertex_indices', 'list uchar float texcoord']).format(1)
+    return header + ''.join('{} {} {}\n'.format(*v) for v in VERTICES) + '7 4 0 1 2 3 2 0.5 0.5\n'
+
+def plyBinary(faces, faceProperties, record):
+    # faces: polygons, written with record(polygon) after the vertices
+    header = plyHeader('binary_little_endian', faceProperties).format(len(faces))
+    return header.encode() + VERTICES.astype('<f4').tobytes() + b''.join(record(f) for f in faces)
+
+def indices(polygon):
+    return np.array([len(polygon)], '<u1').tobytes() + np.array(polygon, '<i4').tobytes()
+
+def check(name, contents):
+    with tempfile.TemporaryDirectory() as directory:
+        file = os.path.join(directory, name)
+        with open(file, 'w' if isinstance(contents, str) else 'wb') as f:
+            f.write(contents)
+        vertices, faces = Reader.readMesh(file)
+    print('    {:48s} vertices {}  faces {}'.format(name, np.array_equal(vertices, VERTICES), np.array_equal(faces, FACES)))
+
+if __name__ == '__main__':
+    flags = lambda record: lambda f: np.array([1], '<u2').tobytes() + record(f)
+    texcoord = lambda record: lambda f: record(f) + np.array([2], '<u1').tobytes() + np.zeros(2, '<f4').tobytes()
+    check('quad.obj', obj())
+    check('quad-ascii.ply', plyAscii())
+    check('quad-polygon.ply', plyBinary([[0, 1, 2, 3]], ['list uchar int vertex_indices'], indices))
+    check('quad-triangles.ply', plyBinary(FACES.tolist(), ['list uchar int vertex_indices'], indices))
+    check('quad-triangles-flags.ply', plyBinary(FACES.tolist(), ['ushort flags', 'list uchar int vertex_indices'], flags(indices)))
+    check('quad-polygon-texcoord.ply', plyBinary([[0, 1, 2, 3]], ['list uchar int vertex_index', 'list uchar float texcoord'], texcoord(indices)))
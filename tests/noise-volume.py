@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Douglas Uba'
+
+import pickle
+import tempfile
+import numpy as np
+from rayden.material import Turbulence
+from rayden.noise.volume import NoiseVolume
+
+def check(name, volume, field, lower, upper, rng):
+    # Grid nodes: the stored field (single precision)
+    x, y, z = np.meshgrid(*(np.linspace(lower[k], upper[k], volume.grid.shape[k]) for k in range(3)), indexing='ij')
+    nodes = np.max(np.abs(volume.sample(x, y, z) - field(x, y, z).astype(np.float32)))
+    # Outside of the box: same values as the nearest points of the box
+    p = rng.uniform(np.subtract(lower, 2.0), np.add(upper, 2.0), (10000, 3)).T
+    clamped = np.clip(p.T, lower, upper).T
+    outside = np.array_equal(volume.sample(*p), volume.sample(*clamped))
+    # Between nodes: trilinear interpolation of the field
+    p = rng.uniform(lower, upper, (10000, 3)).T
+    inside = np.max(np.abs(volume.sample(*p) - field(*p)))
+    print('    {:24s} nodes max error {:.1e}  clamped {}  inside max error {:.3f}'.format(name, nodes, outside, inside))
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    texture = Turbulence(scale=2.0)
+    lower, upper, resolution = (-1.0, -0.5, 0.0), (1.0, 0.5, 3.0), (41, 21, 61)
+
+    check('in memory', NoiseVolume.bake(texture.field, lower, upper, resolution), texture.field, lower, upper, rng)
+    with tempfile.TemporaryDirectory() as directory:
+        key = texture.getParameters()
+        baked = NoiseVolume.bake(texture.field, lower, upper, resolution, directory, key)
+        # Second bake: reused from the file
+        cached = NoiseVolume.bake(lambda x, y, z: None, lower, upper, resolution, directory, key)
+        print('    {:24s} {}'.format('reused file', cached.file == baked.file and np.array_equal(cached.grid, baked.grid)))
+        check('memory-mapped (pickled)', pickle.loads(pickle.dumps(cached)), texture.field, lower, upper, rng)
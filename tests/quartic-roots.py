@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Douglas Uba'
+
+import time
+import numpy as np
+from rayden.math import fqs
+
+def smallestPositive(roots, eps):
+    # Reference: smallest real root > eps among the complex roots
+    real = np.where((np.abs(roots.imag) < 1e-7) & (roots.real > eps), roots.real, np.inf)
+    return real.min(axis=1)
+
+def polynomials(size, degree, doubles, rng):
+    # Coefficients of polynomials with known real roots (the first ones with a double root, e.g. tangent rays)
+    roots = rng.uniform(-5.0, 5.0, (size, degree))
+    roots[:doubles, 1] = roots[:doubles, 0]
+    p = np.zeros((size, degree + 1))
+    p[:, 0] = 1.0
+    for k in range(degree):
+        p[:, 1:] -= p[:, :-1] * roots[:, k:k + 1]
+    return p, roots
+
+def compare(solvers, p, roots, doubles, eps):
+    expected = np.where(roots > eps, roots, np.inf).min(axis=1)
+    for name, f in solvers:
+        start = time.perf_counter()
+        root = f(p)
+        elapsed = time.perf_counter() - start
+        found = np.isfinite(root) & np.isfinite(expected)
+        error = np.where(found, np.abs(root - expected), 0.0)
+        wrong = np.count_nonzero(np.isfinite(root) != np.isfinite(expected)) + np.count_nonzero(error > 1e-4)
+        print('    {:46s} {:7.3f} s  max error {:.2e} (distinct) {:.2e} (double)  wrong {}'.format(
+            name, elapsed, error[doubles:].max(), error[:doubles].max(), wrong))
+
+if __name__ == '__main__':
+    size, eps = 1000000, 1e-6
+    doubles = size // 10
+    rng = np.random.default_rng(0)
+
+    # Warm up the compiled versions
+    fqs.cubic_roots(np.ones((1, 4)))
+    fqs.quartic_roots(np.ones((1, 5)))
+    fqs.min_positive_real_root_cubic(np.ones((1, 4)), eps, compiled=True)
+    fqs.min_positive_real_root_quartic(np.ones((1, 5)), eps, compiled=True)
+
+    print('{} cubics, {} with a double root'.format(size, doubles))
+    p, roots = polynomials(size, 3, doubles, rng)
+    compare([('cubic_roots', lambda p: smallestPositive(fqs.cubic_roots(p), eps)),
+             ('min_positive_real_root_cubic', lambda p: fqs.min_positive_real_root_cubic(p, eps)),
+             ('min_positive_real_root_cubic (compiled)', lambda p: fqs.min_positive_real_root_cubic(p, eps, compiled=True))],
+            p, roots, doubles, eps)
+
+    print('{} quartics, {} with a double root'.format(size, doubles))
+    p, roots = polynomials(size, 4, doubles, rng)
+    compare([('quartic_roots', lambda p: smallestPositive(fqs.quartic_roots(p), eps)),
+             ('min_positive_real_root_quartic', lambda p: fqs.min_positive_real_root_quartic(p, eps)),
+             ('min_positive_real_root_quartic (compiled)', lambda p: fqs.min_positive_real_root_quartic(p, eps, compiled=True))],
+            p, roots, doubles, eps)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Douglas Uba'
+
+import time
+import numpy as np
+from rayden.noise import simplexnoise, vectorized
+
+def compare(name, args, points):
+    # Scalar (one call per point) vs array version of the same noise function
+    start = time.perf_counter()
+    expected = np.array([getattr(simplexnoise, name)(*(args + p)) for p in zip(*points)])
+    scalar = time.perf_counter() - start
+    start = time.perf_counter()
+    values = getattr(vectorized, name)(*(args + tuple(points)))
+    array = time.perf_counter() - start
+    print('    {:24s} scalar {:7.3f} s  array {:7.3f} s  identical {}'.format(
+        name, scalar, array, np.array_equal(values, expected)))
+
+if __name__ == '__main__':
+    size = 200000
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-50.0, 50.0, (4, size))
+    # Lattice points (ties in the simplex selection)
+    points[:, :size // 100] = np.round(points[:, :size // 100])
+
+    print('{} points'.format(size))
+    for d in (2, 3, 4):
+        compare('raw_noise_{}d'.format(d), (), points[:d])
+        compare('scaled_octave_noise_{}d'.format(d), (4, 0.5, 1.0, 0.0, 1.0), points[:d])
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Douglas Uba'
+
+import numpy as np
+from rayden import kernels
+from rayden.constants import MAX_DISTANCE
+from rayden.primitives import Torus
+from rayden.ray import Ray
+from rayden.vector import Vec3
+
+def rays(distance, size, rng):
+    # Rays from a sphere of the given radius, aimed at points around the torus (hits, misses and grazing rays)
+    origin = rng.normal(size=(size, 3))
+    origin *= distance / np.linalg.norm(origin, axis=1)[:, np.newaxis]
+    target = rng.uniform((-1.6, -0.4, -1.6), (1.6, 0.4, 1.6), (size, 3))
+    direction = target - origin
+    direction /= np.linalg.norm(direction, axis=1)[:, np.newaxis]
+    return Ray(Vec3.fromArray(origin), Vec3.fromArray(direction))
+
+def intercept(torus, ray, backend):
+    kernels.setBackend(backend)
+    return torus.intercept(ray)
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    torus = Torus(1.0, 0.35)
+    for distance in (3.0, 1e2, 1e4, 1e6):
+        ray = rays(distance, 100000, rng)
+        expected = intercept(torus, ray, kernels.NUMPY)
+        t = intercept(torus, ray, kernels.NUMBA)
+        hit = expected < MAX_DISTANCE
+        # Hit distance error relative to the distance of the origin
+        error = np.max(np.abs(t[hit] - expected[hit])) / distance if np.any(hit) else 0.0
+        print('    origin at {:8.0e}  hits {:6d}  same hits {}  max relative error {:.1e}'.format(
+            distance, np.count_nonzero(hit), np.array_equal(hit, t < MAX_DISTANCE), error))